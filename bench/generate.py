@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Generate a synthetic running.csv for benchmarks.
+Runs are spread over several years with random gaps, some blank heart rates and
+some garmin style 5:60 paces, rows are written in chunks so 10M rows fit in memory.
+"""
+
+import argparse
+
+import numpy as np
+
+CHUNK_ROWS = 1_000_000
+BLANK_HEART_RATE = 0.1
+# 整分钟的配速有一半写成5:60这种形式
+SIXTY_SECONDS_RATE = 0.5
+GAPS_PER_YEAR = 2
+
+
+def generate_running_csv(
+    path: str,
+    rows: int,
+    seed: int = 0,
+    years: int = 10,
+) -> None:
+    rng = np.random.default_rng(seed)
+    # 每年平均有两段30到90天的空档（受伤、偷懒），剩下的时间均分给每次跑步
+    gap_rows = rng.choice(rows, min(GAPS_PER_YEAR * years, rows // 2), replace=False)
+    span = (years * 365 - len(gap_rows) * 60) * 86400
+    mean_gap = max(span / max(rows, 1), 1.0)
+    # 从years年前开始，让日志大致在今天结束，和真实的日志一样
+    today = np.datetime64("today", "D").astype("M8[s]")
+    current = today - np.timedelta64(years * 365 * 86400, "s")
+    with open(path, "w") as f:
+        f.write("DT,distance(Km),heart,pace\n")
+        for offset in range(0, rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, rows - offset)
+            gaps = np.ceil(rng.exponential(mean_gap, n)).astype(np.int64) + 1
+            in_chunk = gap_rows[(gap_rows >= offset) & (gap_rows < offset + n)]
+            gaps[in_chunk - offset] += rng.integers(30, 91, len(in_chunk)) * 86400
+            dts = current + np.cumsum(gaps).astype("m8[s]")
+            current = dts[-1]
+            distances = np.clip(rng.lognormal(np.log(6.0), 0.45, n), 0.5, 50.0)
+            hearts = np.clip(rng.normal(150, 10, n), 90, 200).astype(np.int64)
+            paces = np.clip(rng.normal(360, 35, n), 200, 600).astype(np.int64)
+            mins, secs = paces // 60, paces % 60
+            sixty = (secs == 0) & (rng.random(n) < SIXTY_SECONDS_RATE)
+            mins = np.where(sixty, mins - 1, mins)
+            secs = np.where(sixty, 60, secs)
+
+            dt_strs = np.char.replace(np.datetime_as_string(dts, unit="s"), "T", " ")
+            heart_strs = np.where(
+                rng.random(n) < BLANK_HEART_RATE, "", hearts.astype(str)
+            )
+            pace_strs = np.char.add(
+                np.char.add(mins.astype(str), ":"), np.char.zfill(secs.astype(str), 2)
+            )
+            columns = [dt_strs, np.char.mod("%.2f", distances), heart_strs, pace_strs]
+            lines = columns[0]
+            for column in columns[1:]:
+                lines = np.char.add(np.char.add(lines, ","), column)
+            f.write("\n".join(lines.tolist()))
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="where to write the csv")
+    parser.add_argument("--rows", type=int, default=10_000, help="number of runs")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--years", type=int, default=10, help="years the runs span")
+    options = parser.parse_args()
+    generate_running_csv(options.path, options.rows, options.seed, options.years)
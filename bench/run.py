@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Time every stage of main.py against generated running logs.
+Each stage is timed without tracing (best of --repeat runs), then run once more
+under tracemalloc for its peak memory. Results are written as json, and can be
+compared with an earlier result file to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable
+
+import numpy as np
+
+import main
+import merge
+import violin
+from bench.generate import generate_running_csv
+from store import RunningLog, get_cache_dir, get_distances, get_generation
+
+SYNC_ROWS = 10
+# 差距比这还小的计时和内存噪声太大，不算退化
+MIN_SECONDS = 0.005
+MIN_BYTES = 1024 * 1024
+# 合并时第二个来源的开始时间晚这么多秒，每条都是重复的
+MERGE_OFFSET_SECONDS = 20
+# 图高5英寸，svg按72dpi算，降采样后的曲线偏离超过1像素就算失真
+PLOT_HEIGHT_PX = 5 * 72
+MAX_ERROR_PX = 1.0
+
+
+def measure(func: Callable, setup: Callable[[], tuple], repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def get_distance_line() -> tuple[np.ndarray, np.ndarray]:
+    shutil.copyfile("pristine.csv", "running.csv")
+    log = main.load_running_log("running.csv")
+    x = log.dt.astype(np.int64).astype(np.float64)
+    return x, np.cumsum(get_distances(log))
+
+
+def write_shifted(csv_path: str, shifted_path: str, seconds: int) -> None:
+    log = main.load_running_log(csv_path)
+    dts = np.datetime_as_string(log.dt + np.timedelta64(seconds, "s")).astype(object)
+    with open(csv_path) as source, open(shifted_path, "w") as target:
+        lines = (line for line in source if not line.startswith("DT,"))
+        for dt, line in zip(dts, lines):
+            target.write(f"{dt.replace('T', ' ')},{line.split(',', 1)[1]}")
+
+
+def get_violins(log: RunningLog, generation: str, year: int) -> None:
+    for series in violin.SERIES:
+        violin.get_violin_stats(log, generation, series)
+        violin.get_violin_stats(log, generation, series, year)
+
+
+def get_stages(rows: int, plot_max_rows: int) -> list[tuple[str, Callable, Callable]]:
+    def clear_cache() -> tuple:
+        shutil.rmtree(get_cache_dir("running.csv"), ignore_errors=True)
+        return ()
+
+    def fresh_log() -> tuple:
+        shutil.copyfile("pristine.csv", "running.csv")
+        main.load_running_log("running.csv")
+        return ()
+
+    def new_runs() -> tuple:
+        fresh_log()
+        # 同步前索引已经是最新的，只算新的几行
+        main.load_records("running.csv")
+        latest = main.load_running_log("running.csv").dt[-1].item()
+        dts = [latest + timedelta(days=i + 1) for i in range(SYNC_ROWS)]
+        return (
+            ",".join(f"{dt:%Y-%m-%d %H:%M:%S}" for dt in dts),
+            ",".join(["5.00"] * SYNC_ROWS),
+            ",".join(["150"] * SYNC_ROWS),
+            ",".join(["5:60"] * SYNC_ROWS),
+        )
+
+    def clear_render() -> tuple:
+        fresh_log()
+        shutil.rmtree(os.path.join(get_cache_dir("running.csv"), "render"), True)
+        if os.path.exists("miles.svg"):
+            os.remove("miles.svg")
+        return ()
+
+    def clear_rollup() -> tuple:
+        shutil.rmtree(os.path.join(get_cache_dir("running.csv"), "rollup"), True)
+        return ("running.csv",)
+
+    def clear_records() -> tuple:
+        path = os.path.join(get_cache_dir("running.csv"), "records.json")
+        if os.path.exists(path):
+            os.remove(path)
+        return ("running.csv",)
+
+    def clear_violins() -> tuple:
+        violin._histograms.clear()
+        violin._stats.clear()
+        return warm_violins()
+
+    def warm_violins() -> tuple:
+        log = main.load_running_log("running.csv")
+        return log, get_generation("running.csv"), log.dt[-1].item().year
+
+    fresh_log()
+    write_shifted("pristine.csv", "shifted.csv", MERGE_OFFSET_SECONDS)
+    rollup = main.load_rollup("running.csv")
+    dts = main.get_running_data()[0]
+    stages = [
+        ("get_running_data_cold", main.get_running_data, clear_cache),
+        ("get_running_data_warm", main.get_running_data, fresh_log),
+        ("sync_data", main.sync_data, new_runs),
+        (
+            "merge_sources",
+            merge.merge_sources,
+            lambda: (["pristine.csv", "shifted.csv"], "merged.csv"),
+        ),
+        ("load_rollup_cold", main.load_rollup, clear_rollup),
+        ("load_rollup_warm", main.load_rollup, lambda: ("running.csv",)),
+        ("load_records_cold", main.load_records, clear_records),
+        ("load_records_warm", main.load_records, lambda: ("running.csv",)),
+        ("get_attendance", main.get_attendance, lambda: (rollup.month,)),
+        ("get_training_load", main.get_training_load, lambda: (rollup.day,)),
+        ("get_violin_stats_cold", get_violins, clear_violins),
+        ("get_violin_stats_warm", get_violins, warm_violins),
+        (
+            "downsample_lttb",
+            main.downsample_lttb,
+            lambda: (*get_distance_line(), main.POINT_BUDGET),
+        ),
+        (
+            "get_days_monthly",
+            main.get_days_monthly,
+            lambda: (dts[0].year, dts[-1].year, dts[0].month, dts[-1].month),
+        ),
+    ]
+    if rows <= plot_max_rows:
+        # 导入matplotlib的时间不算在第一次画图里
+        import matplotlib.pyplot  # noqa: F401
+
+        stages.append(("plot_running", main.plot_running, clear_render))
+    return stages
+
+
+def get_fidelity() -> float:
+    """
+    Largest distance in pixels between the full and the downsampled distance line
+    """
+    x, y = get_distance_line()
+    kept = main.downsample_lttb(x, y, main.POINT_BUDGET)
+    return main.get_downsample_error(x, y, kept) * PLOT_HEIGHT_PX
+
+
+def run(sizes: list[int], seed: int, repeat: int, plot_max_rows: int) -> dict:
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for rows in sizes:
+                generate_running_csv("pristine.csv", rows, seed)
+                for stage, func, setup in get_stages(rows, plot_max_rows):
+                    result = {"rows": rows, "stage": stage}
+                    result.update(measure(func, setup, repeat))
+                    if stage == "downsample_lttb":
+                        result["max_error_px"] = get_fidelity()
+                    print(
+                        f"{rows:>10} {stage:<24} {result['seconds']:>10.4f}s "
+                        f"{result['peak_bytes'] / 1024 / 1024:>10.1f}MiB",
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+    return {
+        "created": f"{datetime.now():%Y-%m-%d %H:%M:%S}",
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    before = {(r["rows"], r["stage"]): r for r in baseline["results"]}
+    ok = True
+    for r in current["results"]:
+        old = before.get((r["rows"], r["stage"]))
+        if old is None:
+            continue
+        ratio = r["seconds"] / max(old["seconds"], 1e-9)
+        memory = r["peak_bytes"] / max(old["peak_bytes"], 1)
+        slower = ratio > threshold and r["seconds"] - old["seconds"] > MIN_SECONDS
+        bigger = memory > threshold and r["peak_bytes"] - old["peak_bytes"] > MIN_BYTES
+        distorted = r.get("max_error_px", 0.0) > MAX_ERROR_PX
+        regressed = slower or bigger or distorted
+        ok = ok and not regressed
+        print(
+            f"{r['rows']:>10} {r['stage']:<24} time x{ratio:<6.2f} "
+            f"memory x{memory:<6.2f}{' REGRESSED' if regressed else ''}"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rows",
+        default="1000,10000,100000",
+        help="comma separated log sizes, e.g. 1000,1000000,10000000",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="generator random seed")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument(
+        "--plot-max-rows",
+        dest="plot_max_rows",
+        type=int,
+        default=100_000,
+        help="skip plot_running for larger logs",
+    )
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--compare", help="json results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="time or memory ratio that counts as a regression",
+    )
+    options = parser.parse_args()
+    sizes = [int(rows) for rows in options.rows.split(",")]
+    report = run(sizes, options.seed, options.repeat, options.plot_max_rows)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            if not compare(json.load(f), report, options.threshold):
+                sys.exit(1)
@@ -1,16 +1,167 @@
 # -*- coding: utf-8 -*-
-def parse_garmin_export_data() -> None:
-    with open("Activities.csv") as source:
-        with open("running.csv", "a") as target:
-            for line in reversed(list(source)):
-                cols = line.rstrip().split(",")
-                if cols[0] == "活动类型":
-                    continue
-                distance = cols[4][1:-1]
+"""
+Import a Garmin Connect Activities.csv export into running.csv.
+The export is streamed in chunks with a csv reader, columns are looked up by
+their (Chinese or English) header, runs already in running.csv are skipped through
+the timestamp index of the store, and the newest-first export is put back in time
+order through sorted spill files, so exports of any size import in one pass.
+Run it from the repository root: python -m extractor.garmin Activities.csv
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import os
+import re
+import tempfile
+from datetime import datetime
+from typing import Iterator
+
+import numpy as np
+
+from store import (
+    append_running_lines,
+    contains_timestamps,
+    load_running_log,
+    merge_sorted_running_lines,
+)
+
+# 每块排好序写一个临时文件，最后一起归并，块太小临时文件会太多
+CHUNK_ROWS = 100_000
+# 中文和英文导出的表头
+HEADER_ALIASES = {
+    "dt": ("日期", "Date"),
+    "distance": ("距离", "Distance"),
+    "heart": ("平均心率", "Avg HR"),
+    "pace": ("平均配速", "Avg Pace"),
+}
+PACE_PATTERN = re.compile(r"\d+:\d\d")
+
+
+def get_columns(header: list[str]) -> dict[str, int]:
+    names = [name.strip() for name in header]
+    columns = {}
+    for column, aliases in HEADER_ALIASES.items():
+        found = [names.index(alias) for alias in aliases if alias in names]
+        if not found:
+            raise ValueError(f"export has no {' or '.join(aliases)} column")
+        columns[column] = found[0]
+    return columns
+
+
+def read_export(path: str) -> Iterator[tuple[datetime, str]]:
+    """
+    Yield (start time, running.csv line) for every usable run in the export
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        columns = get_columns(next(reader))
+        width = max(columns.values()) + 1
+        for row in reader:
+            if len(row) < width:
+                continue
+            # 距离可能带千分位，心率和配速没有时是--
+            distance = row[columns["distance"]].replace(",", "").strip()
+            heart = row[columns["heart"]].replace(",", "").strip()
+            pace = row[columns["pace"]].strip()
+            try:
+                dt = datetime.strptime(row[columns["dt"]].strip(), "%Y-%m-%d %H:%M:%S")
                 if float(distance) <= 0.0:
                     continue
-                target.write(f"{cols[1]},{distance},{cols[7][1:-1]},{cols[11][1:-1]}\n")
+            except ValueError:
+                continue
+            if not PACE_PATTERN.fullmatch(pace):
+                continue
+            if not heart.isdigit():
+                heart = ""
+            yield dt, f"{dt:%Y-%m-%d %H:%M:%S},{distance},{heart},{pace}"
+
+
+def spill_chunks(
+    rows: Iterator[tuple[datetime, str]], csv_path: str, spill_dir: str
+) -> list[str]:
+    """
+    Drop runs that are already stored and write the rest to sorted spill files
+    of at most CHUNK_ROWS lines each
+    """
+    log = load_running_log(csv_path)
+    spills = []
+    while True:
+        chunk = [row for _, row in zip(range(CHUNK_ROWS), rows)]
+        if not chunk:
+            return spills
+        dts = np.array([dt for dt, _ in chunk], dtype="datetime64[s]")
+        new = ~contains_timestamps(log, dts)
+        chunk = sorted(
+            (row for row, keep in zip(chunk, new) if keep), key=lambda r: r[0]
+        )
+        if chunk:
+            spill = os.path.join(spill_dir, f"{len(spills)}.csv")
+            with open(spill, "w") as f:
+                f.writelines(f"{line}\n" for _, line in chunk)
+            spills.append(spill)
+
+
+def read_spills(spills: list[str]) -> Iterator[str]:
+    """
+    Merge the sorted spill files, a run exported twice is only kept once
+    """
+    files = [open(spill) for spill in spills]
+    try:
+        last = None
+        for line in heapq.merge(*files, key=lambda line: line.split(",", 1)[0]):
+            dt = line.split(",", 1)[0]
+            if dt != last:
+                last = dt
+                yield line.rstrip("\n")
+    finally:
+        for f in files:
+            f.close()
+
+
+def parse_garmin_export_data(
+    export_path: str = "Activities.csv", csv_path: str = "running.csv"
+) -> int:
+    if not os.path.exists(csv_path):
+        with open(csv_path, "w") as f:
+            f.write("DT,distance(Km),heart,pace\n")
+    spill_root = os.path.dirname(os.path.abspath(csv_path))
+    with tempfile.TemporaryDirectory(dir=spill_root) as spill_dir:
+        spills = spill_chunks(read_export(export_path), csv_path, spill_dir)
+        lines = read_spills(spills)
+        first = next(lines, None)
+        if first is None:
+            print("no new data")
+            return 0
+        count = 0
+
+        def counted() -> Iterator[str]:
+            nonlocal count
+            for line in itertools.chain([first], lines):
+                count += 1
+                yield line
+
+        # 导出的都比已有的新就直接追加，否则流式合并到正确的位置
+        log = load_running_log(csv_path)
+        if not len(log.dt) or np.datetime64(first.split(",", 1)[0]) >= log.dt[-1]:
+            append_running_lines(csv_path, counted())
+        else:
+            merge_sorted_running_lines(csv_path, counted())
+    print(f"imported {count} runs")
+    return count
 
 
 if __name__ == "__main__":
-    parse_garmin_export_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "export",
+        nargs="?",
+        default="Activities.csv",
+        help="Activities.csv exported from garmin connect",
+    )
+    parser.add_argument(
+        "--csv", default="running.csv", help="running log to import into"
+    )
+    options = parser.parse_args()
+    parse_garmin_export_data(options.export, options.csv)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-stage timing and memory instrumentation.
+Set MILES_PROFILE=1 (or pass --profile to main.py) to record wall time, cpu time,
+allocated bytes and row counts of every stage, and MILES_CPROFILE=<file> (or
+--cprofile <file>) to dump a cProfile of the whole render.
+"""
+
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.cprofile_path = None
+        self.records = []
+        self._stack = []
+
+    def enable(self, cprofile_path: Optional[str] = None) -> None:
+        self.enabled = True
+        self.cprofile_path = cprofile_path or self.cprofile_path
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, rows: Optional[int] = None) -> Iterator[dict]:
+        record = {"stage": name, "depth": len(self._stack), "rows": rows}
+        if not self.enabled:
+            yield record
+            return
+        # 嵌套的阶段会重置峰值，重置前先把峰值记到外层阶段上
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame["peak"] = max(frame["peak"], peak)
+        tracemalloc.reset_peak()
+        frame = {"start": current, "peak": current}
+        self._stack.append(frame)
+        self.records.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], frame["peak"])
+            record["allocated_bytes"] = frame["peak"] - frame["start"]
+
+    @contextmanager
+    def cprofile(self) -> Iterator[None]:
+        if not self.cprofile_path:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(self.cprofile_path)
+
+    def report(self, file=sys.stderr) -> None:
+        if self.enabled:
+            json.dump({"stages": self.records}, file, indent=2)
+            file.write("\n")
+
+
+profiler = StageProfiler()
+if os.getenv("MILES_PROFILE"):
+    profiler.enable(os.getenv("MILES_CPROFILE"))
+elif os.getenv("MILES_CPROFILE"):
+    profiler.cprofile_path = os.getenv("MILES_CPROFILE")
@@ -1,195 +1,773 @@
 # -*- coding: utf-8 -*-
+import argparse
+import base64
 import calendar
+import csv
+import functools
+import gzip
+import hashlib
+import io
 import math
+import os
+import re
+import shutil
 import sys
-from datetime import datetime
-from typing import Callable, Optional, TypeVar
+import time
+import traceback
+import zlib
+from datetime import date, datetime
+from typing import Callable, NamedTuple, Optional, Sequence, TypeVar, Union
 import numpy as np
 
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-import matplotlib.ticker as tick
-from matplotlib.offsetbox import AnnotationBbox, OffsetImage
+from instrument import profiler
+from records import Records, get_current_streak, load_records
+from rollup import DISTANCE_DECIMALS, load_rollup
+from store import (
+    append_running_lines,
+    contains_timestamps,
+    get_cache_dir,
+    get_distances,
+    get_generation,
+    load_running_log,
+    merge_running_lines,
+)
+from violin import get_violin_stats
 
 RUNNER = "NAOSENSE"
+RUNNER_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner.png")
+RENDER_CACHE_SIZE = 8
+# 图里的数据也由这些模块计算，和main.py一起算进指纹，改了就要重新画
+RENDER_MODULES = ("store", "rollup", "records", "violin")
+# 累计距离曲线最多画这么多个点，比图的像素宽度略多，记录再多文件大小也不变
+POINT_BUDGET = 1000
+OUTPUT_FORMATS = ("svg", "svgz", "png", "webp")
+# 1/100pt远小于一个像素，--optimize时svg坐标只保留两位小数
+OPTIMIZED_PRECISION = 2
+# 急性负荷、慢性负荷的天数，训练负荷面板只画最近LOAD_DAYS天
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+LOAD_DAYS = 365
+SVG_COORDINATES = re.compile(
+    r'( (?:d|x|y|x1|y1|x2|y2|cx|cy|r|width|height|points|transform)=")([^"]*)"'
+)
+SVG_NUMBER = re.compile(r"-?\d+\.\d+")
+SVG_IMAGE = re.compile(r'<image xlink:href="(data:[^"]*)"([^>]*)/>')
+SVG_ATTRIBUTE = re.compile(r'(\w+)="([^"]*)"')
 
 T = TypeVar("T")
-K = TypeVar("K")
-
-
-def plot_running() -> None:
-    with plt.xkcd():
-        fig, ax = plt.subplots(figsize=(8, 5), constrained_layout=True)
-        ax.spines[["top", "right"]].set_visible(False)
-        locator = mdates.AutoDateLocator(minticks=3, maxticks=7)
-        formatter = mdates.ConciseDateFormatter(locator)
-        ax.xaxis.set_major_locator(locator)
-        ax.xaxis.set_major_formatter(formatter)
-        ax.tick_params(axis="both", which="major", labelsize="small", length=5)
-        ax.tick_params(axis="both", which="minor", labelsize="small", length=5)
-        ax.set_title("Running is not a sport for health, it is a way of life!")
-
-        dts, accs, distances, hearts, paces = get_running_data()
-        this_year = datetime.now().year
-
-        ax.plot(dts, accs, color="#d62728")
-        ax2 = plt.axes([0.1, 0.80, 0.3, 0.1])
-        v11 = ax2.violinplot(
-            hearts,
-            orientation="horizontal",
-            showmedians=True,
-            showmeans=True,
-            showextrema=False,
-            side="low",
+
+
+class TrainingLoad(NamedTuple):
+    days: np.ndarray
+    # 截至当天7天的跑量
+    weekly: np.ndarray
+    # 截至当天7天、28天平均每天的跑量，以及两者的比值，慢性负荷为0时是nan
+    acute: np.ndarray
+    chronic: np.ndarray
+    ratio: np.ndarray
+
+
+class OutputOptions(NamedTuple):
+    # svg坐标保留的小数位数，None时是matplotlib默认的6位
+    precision: Optional[int] = None
+    # 相同的内嵌图片只保存一份，其余的引用它
+    dedup_images: bool = False
+    # 小提琴图和雷达图的填充画成位图
+    rasterize: bool = False
+    # png、webp和svg中位图部分的分辨率
+    dpi: int = 100
+
+
+def plot_running(
+    runner: str = RUNNER,
+    csv_path: str = "running.csv",
+    output: Union[str, Sequence[str]] = "miles.svg",
+    points: int = POINT_BUDGET,
+    options: OutputOptions = OutputOptions(),
+) -> None:
+    """
+    Render the chart to one or more files, the format follows the extension
+    (see OUTPUT_FORMATS) and the figure is only drawn once for all of them
+    """
+    outputs = [output] if isinstance(output, str) else list(output)
+    with profiler.stage("plot_running"), profiler.cprofile():
+        pending = {}
+        for path in outputs:
+            fingerprint = get_render_fingerprint(
+                runner, csv_path, points, options, path
+            )
+            if is_rendered(path, fingerprint):
+                print(f"{path} is up to date")
+            elif restore_render(csv_path, path, fingerprint):
+                print(f"{path} restored from render cache")
+            else:
+                pending[path] = fingerprint
+        if not pending:
+            return
+        render_running(pending, runner, csv_path, points, options)
+        for path, fingerprint in pending.items():
+            save_render(csv_path, path, fingerprint)
+
+
+def render_running(
+    fingerprints: dict[str, str],
+    runner: str,
+    csv_path: str,
+    points: int = POINT_BUDGET,
+    options: OutputOptions = OutputOptions(),
+) -> None:
+    """
+    Draw the chart once and save it to every output in fingerprints
+    """
+    chart = Chart(runner, csv_path, points, options)
+    chart.update()
+    for output, fingerprint in fingerprints.items():
+        start = time.perf_counter()
+        chart.save(output, fingerprint)
+        print(
+            f"{output:<24} {os.path.getsize(output):>10} bytes "
+            f"{time.perf_counter() - start:>8.3f}s"
         )
-        hearts_this_year = [
-            hearts[i] for i, dt in enumerate(dts) if dt.year == this_year
-        ]
-        v12 = ax2.violinplot(
-            hearts_this_year,
-            orientation="horizontal",
-            showmedians=True,
-            showmeans=True,
-            showextrema=False,
-            side="high",
+    chart.close()
+
+
+class Chart:
+    """
+    The figure with its axes and the runner image, update only redraws the panels
+    whose data changed since the last update, so serve keeps one between renders
+    """
+
+    def __init__(
+        self,
+        runner: str = RUNNER,
+        csv_path: str = "running.csv",
+        points: int = POINT_BUDGET,
+        options: OutputOptions = OutputOptions(),
+    ):
+        # matplotlib导入很慢，真正需要画图时才导入
+        with profiler.stage("import matplotlib"):
+            import matplotlib.pyplot as plt
+
+        self.runner = runner
+        self.csv_path = csv_path
+        self.points = points
+        self.options = options
+        self.image = plt.imread(RUNNER_IMAGE)
+        # 每个面板上次画图时用的数据，没变就不重画
+        self.keys: dict[str, tuple] = {}
+        self.summary = None
+        with plt.xkcd():
+            self.fig, self.ax = plt.subplots(figsize=(8, 5), constrained_layout=True)
+            self.heart_ax = self.fig.add_axes([0.1, 0.80, 0.3, 0.1])
+            self.pace_ax = self.fig.add_axes([0.1, 0.65, 0.3, 0.1])
+            self.attendance_ax = self.fig.add_axes([0.1, 0.3, 0.25, 0.25], polar=True)
+            self.add_load_axes()
+
+    def add_load_axes(self) -> None:
+        self.load_ax = self.fig.add_axes([0.45, 0.68, 0.25, 0.12])
+        self.ratio_ax = self.load_ax.twinx()
+
+    def changed(self, panel: str, key: tuple) -> bool:
+        if self.keys.get(panel) == key:
+            return False
+        self.keys[panel] = key
+        return True
+
+    def update(self) -> list[str]:
+        """
+        Redraw the panels whose data changed, returns their names
+        """
+        import matplotlib.pyplot as plt
+        import matplotlib.ticker as tick
+
+        log = load_running_log(self.csv_path)
+        generation = get_generation(self.csv_path)
+        rollup = load_rollup(self.csv_path)
+        today = date.today()
+        this_year = today.year
+        # 同一个generation里行数没变，数据就没变
+        version = (generation, len(log.dt), this_year)
+        drawn = []
+        with plt.xkcd():
+            if self.changed("distance", (*version, self.points)):
+                with profiler.stage("distance panel", rows=len(log.dt)) as record:
+                    accs = np.cumsum(get_distances(log))
+                    x = log.dt.astype(np.int64).astype(np.float64)
+                    kept = downsample_lttb(x, accs, self.points)
+                    record["points"] = len(kept)
+                    self.ax.clear()
+                    # 只把留下的点转成python对象
+                    plot_distance(self.ax, log.dt[kept].tolist(), accs[kept].tolist())
+                    plot_runner_image(self.ax, self.image)
+                drawn.append("distance")
+
+            if self.changed("heart", version):
+                with profiler.stage("heart panel", rows=int(log.heart_mask.sum())):
+                    self.heart_ax.clear()
+                    plot_violins(
+                        self.heart_ax,
+                        get_violin_stats(log, generation, "heart"),
+                        get_violin_stats(log, generation, "heart", this_year),
+                        self.options.rasterize,
+                    )
+                drawn.append("heart")
+
+            if self.changed("pace", version):
+                with profiler.stage("pace panel", rows=len(log.pace)):
+                    self.pace_ax.clear()
+                    plot_violins(
+                        self.pace_ax,
+                        get_violin_stats(log, generation, "pace"),
+                        get_violin_stats(log, generation, "pace", this_year),
+                        self.options.rasterize,
+                    )
+                    self.pace_ax.xaxis.set_major_locator(tick.MaxNLocator(6))
+                    self.pace_ax.xaxis.set_major_formatter(
+                        tick.FuncFormatter(pace_label_fmt)
+                    )
+                drawn.append("pace")
+
+            # 同一天跑第二次或者只改了距离时出勤率不变
+            attendance = tuple(map(tuple, get_attendance(rollup.month)))
+            if self.changed("attendance", attendance):
+                with profiler.stage("attendance panel", rows=len(rollup.month)):
+                    self.attendance_ax.clear()
+                    plot_attendance(
+                        self.attendance_ax, rollup.month, self.options.rasterize
+                    )
+                drawn.append("attendance")
+
+            redraw = "load" in self.keys
+            if self.changed("load", version):
+                with profiler.stage("load panel", rows=len(rollup.day)) as record:
+                    load = get_training_load(rollup.day)
+                    record["days"] = len(load.days)
+                    # clear以后共享的x轴范围会和新建的不一样，双y轴直接换新的
+                    if redraw:
+                        self.load_ax.remove()
+                        self.ratio_ax.remove()
+                        self.add_load_axes()
+                    plot_training_load(self.load_ax, self.ratio_ax, load)
+                drawn.append("load")
+
+            latest_distance = get_distances(log)[-1]
+            text = get_summary(
+                self.runner,
+                rollup.year,
+                log.dt[-1].item(),
+                latest_distance,
+                today,
+                load_records(self.csv_path),
+            )
+            if self.changed("summary", (text,)):
+                with profiler.stage("summary panel", rows=len(rollup.year)):
+                    if self.summary is not None:
+                        self.summary.remove()
+                    self.summary = plot_summary(self.fig, text)
+                drawn.append("summary")
+        return drawn
+
+    def get_data(self, fmt: str, fingerprint: str) -> bytes:
+        import matplotlib.pyplot as plt
+
+        with plt.xkcd(), profiler.stage(f"savefig {fmt}"):
+            return get_figure_data(self.fig, fmt, fingerprint, self.options)
+
+    def save(self, output: str, fingerprint: str) -> None:
+        data = self.get_data(get_format(output), fingerprint)
+        with open(output, "wb") as f:
+            f.write(data)
+
+    def close(self) -> None:
+        import matplotlib.pyplot as plt
+
+        plt.close(self.fig)
+
+
+def serve_running(
+    runner: str = RUNNER,
+    csv_path: str = "running.csv",
+    formats: Sequence[str] = ("svg",),
+    points: int = POINT_BUDGET,
+    options: OutputOptions = OutputOptions(),
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    interval: float = 1.0,
+) -> None:
+    """
+    Keep the chart in memory and serve it as /miles.<format>, the panels whose
+    data changed are redrawn whenever csv_path changes
+    """
+    from serve import serve
+
+    chart = Chart(runner, csv_path, points, options)
+
+    def update() -> dict[str, tuple[str, Callable[[], bytes]]]:
+        start = time.perf_counter()
+        drawn = chart.update()
+        print(
+            f"redrew {', '.join(drawn) or 'nothing'} "
+            f"in {time.perf_counter() - start:.3f}s"
         )
+        # 指纹没变的文件不会重新渲染
+        files = {}
+        for fmt in formats:
+            name = f"miles.{fmt}"
+            fingerprint = get_render_fingerprint(
+                runner, csv_path, points, options, name
+            )
+            files[name] = (
+                fingerprint,
+                functools.partial(chart.get_data, fmt, fingerprint),
+            )
+        return files
 
-        for body in v11["bodies"]:
-            body.set_facecolor("#ff7f0e")
-            body.set_edgecolor("#ff7f0e")
-        for body in v12["bodies"]:
-            body.set_facecolor("#2ca02c")
-            body.set_edgecolor("#2ca02c")
-        v11["cmedians"].set_linewidth(1)
-        v11["cmedians"].set_color("#ff7f0e")
-        v12["cmedians"].set_linewidth(1)
-        v12["cmedians"].set_color("#2ca02c")
-        v11["cmeans"].set_linewidth(1)
-        v11["cmeans"].set_color("#ff7f0e")
-        v12["cmeans"].set_linewidth(1)
-        v12["cmeans"].set_color("#2ca02c")
-        v11["cmeans"].set_linestyle("--")
-        v12["cmeans"].set_linestyle("--")
-
-        hearts_percentile = np.percentile(hearts, [5, 95])
-        ax2.set_xlim(tuple(hearts_percentile))
-        ax2.set_yticklabels([])
-        ax2.spines[["top", "right", "left", "bottom"]].set_visible(False)
-        ax2.tick_params(axis="x", which="major", labelsize="xx-small", length=2)
-        ax2.tick_params(axis="y", which="major", labelsize="xx-small", length=0)
-
-        ax3 = plt.axes([0.1, 0.65, 0.3, 0.1])
-        v21 = ax3.violinplot(
-            paces,
-            orientation="horizontal",
-            showmedians=True,
-            showmeans=True,
-            showextrema=False,
-            side="low",
+    serve(update, csv_path, host, port, interval)
+
+
+def get_format(output: str) -> str:
+    fmt = os.path.splitext(output)[1][1:].lower()
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"{output}: output must be one of {', '.join(OUTPUT_FORMATS)}")
+    return fmt
+
+
+def get_figure_data(fig, fmt: str, fingerprint: str, options: OutputOptions) -> bytes:
+    import matplotlib
+
+    # 指纹写进文件里，is_rendered据此判断是否需要重画
+    description = f"fingerprint {fingerprint}"
+    buffer = io.BytesIO()
+    if fmt == "png":
+        fig.savefig(
+            buffer, format=fmt, dpi=options.dpi, metadata={"Description": description}
+        )
+        return buffer.getvalue()
+    if fmt == "webp":
+        fig.savefig(
+            buffer,
+            format=fmt,
+            dpi=options.dpi,
+            pil_kwargs={"xmp": description.encode()},
+        )
+        return buffer.getvalue()
+    # svg中的id由hashsalt生成，固定下来后相同的输入得到相同的文件
+    matplotlib.rcParams["svg.hashsalt"] = fingerprint
+    fig.savefig(
+        buffer,
+        format="svg",
+        dpi=options.dpi,
+        metadata={"Date": None, "Description": description},
+    )
+    svg = buffer.getvalue().decode()
+    if options.precision is not None:
+        svg = round_svg_numbers(svg, options.precision)
+    if options.dedup_images:
+        svg = dedup_svg_images(svg)
+    data = svg.encode()
+    if fmt == "svgz":
+        data = gzip.compress(data, mtime=0)
+    return data
+
+
+def round_svg_numbers(svg: str, precision: int) -> str:
+    """
+    Round the coordinates in path data, positions, sizes and transforms
+    """
+
+    def round_number(match: re.Match) -> str:
+        number = f"{float(match.group()):.{precision}f}"
+        if "." in number:
+            number = number.rstrip("0").rstrip(".")
+        return "0" if number == "-0" else number
+
+    return SVG_COORDINATES.sub(
+        lambda m: f'{m.group(1)}{SVG_NUMBER.sub(round_number, m.group(2))}"', svg
+    )
+
+
+def dedup_svg_images(svg: str) -> str:
+    """
+    Keep one copy of every embedded image that is drawn more than once in defs,
+    and draw each of them with use
+    """
+    images = SVG_IMAGE.findall(svg)
+    counts: dict[tuple[str, str, str], int] = {}
+    for href, rest in images:
+        attributes = dict(SVG_ATTRIBUTE.findall(rest))
+        key = (href, attributes.get("width", ""), attributes.get("height", ""))
+        counts[key] = counts.get(key, 0) + 1
+    ids = {
+        key: f"image_{i}" for i, key in enumerate(k for k, n in counts.items() if n > 1)
+    }
+    if not ids:
+        return svg
+
+    def use_image(match: re.Match) -> str:
+        attributes = dict(SVG_ATTRIBUTE.findall(match.group(2)))
+        key = (
+            match.group(1),
+            attributes.pop("width", ""),
+            attributes.pop("height", ""),
         )
-        paces_this_year = [paces[i] for i, dt in enumerate(dts) if dt.year == this_year]
-        v22 = ax3.violinplot(
-            paces_this_year,
+        if key not in ids:
+            return match.group()
+        # use的x、y等于在transform之后再平移，和image自己的x、y效果相同
+        rest = "".join(f' {name}="{value}"' for name, value in attributes.items())
+        return f'<use xlink:href="#{ids[key]}"{rest}/>'
+
+    defs = "".join(
+        f'  <image id="{image_id}" xlink:href="{href}" '
+        f'width="{width}" height="{height}"/>\n'
+        for (href, width, height), image_id in ids.items()
+    )
+    svg = SVG_IMAGE.sub(use_image, svg)
+    end = svg.rindex("</svg>")
+    return f"{svg[:end]} <defs>\n{defs} </defs>\n{svg[end:]}"
+
+
+def plot_distance(ax, dts: list[datetime], accs: list[float]) -> None:
+    import matplotlib.dates as mdates
+
+    ax.spines[["top", "right"]].set_visible(False)
+    locator = mdates.AutoDateLocator(minticks=3, maxticks=7)
+    formatter = mdates.ConciseDateFormatter(locator)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(formatter)
+    ax.tick_params(axis="both", which="major", labelsize="small", length=5)
+    ax.tick_params(axis="both", which="minor", labelsize="small", length=5)
+    ax.set_title("Running is not a sport for health, it is a way of life!")
+    ax.plot(dts, accs, color="#d62728")
+
+
+def plot_training_load(ax, ratio_ax, load: TrainingLoad) -> None:
+    import matplotlib.dates as mdates
+
+    # 更早的数据只用来算慢性负荷
+    days = load.days[-LOAD_DAYS:]
+    ax.fill_between(
+        days, load.weekly[-LOAD_DAYS:], color="#ff7f0e", alpha=0.3, linewidth=0
+    )
+    ax.plot(days, load.chronic[-LOAD_DAYS:] * ACUTE_DAYS, color="#ff7f0e", lw=1)
+    # 急慢性负荷比在0.8到1.3之间比较安全，按天画太密，只画每周最后一天的
+    ratio_ax.axhspan(0.8, 1.3, color="#2ca02c", alpha=0.1, linewidth=0)
+    weeks = np.arange(len(days) - 1, -1, -ACUTE_DAYS)[::-1]
+    ratio = load.ratio[-LOAD_DAYS:]
+    ratio_ax.plot(days[weeks], ratio[weeks], color="#2ca02c", lw=0.8)
+    ratio_ax.set_ylim(0, 2)
+    ax.set_ylim(bottom=0)
+    ax.set_title("weekly Km / acute:chronic", fontsize="xx-small")
+    locator = mdates.AutoDateLocator(minticks=2, maxticks=4)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    for a in (ax, ratio_ax):
+        a.spines[["top", "left", "right"]].set_visible(False)
+        a.tick_params(axis="both", which="major", labelsize="xx-small", length=2)
+
+
+def downsample_lttb(x: np.ndarray, y: np.ndarray, budget: int) -> np.ndarray:
+    """
+    Indices of at most budget points chosen by largest-triangle-three-buckets,
+    the first and last points are always kept
+    """
+    n = len(x)
+    if n <= budget or budget < 3:
+        return np.arange(n)
+    # 中间的点分成budget-2个桶，每个桶留下和前一个选中点、后一个桶均值围成三角形最大的点
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    kept = np.empty(budget, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(budget - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+
+def get_downsample_error(x: np.ndarray, y: np.ndarray, kept: np.ndarray) -> float:
+    """
+    Largest vertical distance between the full and the downsampled line,
+    as a fraction of the y range
+    """
+    span = float(y.max() - y.min()) if len(y) else 0.0
+    if not span:
+        return 0.0
+    return float(np.abs(np.interp(x, x[kept], y[kept]) - y).max() / span)
+
+
+def plot_violins(
+    ax,
+    stats_all: Optional[dict],
+    stats_this_year: Optional[dict],
+    rasterized: bool = False,
+) -> None:
+    # 左半边是所有数据，右半边是今年的数据，今年还没跑过时只画左半边
+    for stats, side, color in (
+        (stats_all, "low", "#ff7f0e"),
+        (stats_this_year, "high", "#2ca02c"),
+    ):
+        if stats is None:
+            continue
+        # 统计量由violin.py按直方图算好，不用violinplot对每个值做核密度估计
+        parts = ax.violin(
+            [stats],
             orientation="horizontal",
             showmedians=True,
             showmeans=True,
             showextrema=False,
-            side="high",
-        )
-        for body in v21["bodies"]:
-            body.set_facecolor("#ff7f0e")
-            body.set_edgecolor("#ff7f0e")
-        for body in v22["bodies"]:
-            body.set_facecolor("#2ca02c")
-            body.set_edgecolor("#2ca02c")
-        v21["cmedians"].set_linewidth(1)
-        v21["cmedians"].set_color("#ff7f0e")
-        v22["cmedians"].set_linewidth(1)
-        v22["cmedians"].set_color("#2ca02c")
-        v21["cmeans"].set_linewidth(1)
-        v21["cmeans"].set_color("#ff7f0e")
-        v22["cmeans"].set_linewidth(1)
-        v22["cmeans"].set_color("#2ca02c")
-        v21["cmeans"].set_linestyle("--")
-        v22["cmeans"].set_linestyle("--")
-
-        paces_percentile = np.percentile(paces, [5, 95])
-        ax3.set_xlim(tuple(paces_percentile))
-        ax3.set_yticklabels([])
-        ax3.spines[["top", "right", "left", "bottom"]].set_visible(False)
-        ax3.tick_params(axis="x", which="major", labelsize="xx-small", length=2)
-        ax3.tick_params(axis="y", which="major", labelsize="xx-small", length=0)
-        ax3.xaxis.set_major_locator(tick.MaxNLocator(6))
-        ax3.xaxis.set_major_formatter(tick.FuncFormatter(pace_label_fmt))
-
-        attendance_all, attendance_this_year = tuple(
-            map(make_circular, get_attendance(dts))
-        )
-        feature = make_circular(
-            [
-                "Jan",
-                "",
-                "",
-                "Apr",
-                "",
-                "",
-                "Jul",
-                "",
-                "",
-                "Oct",
-                "",
-                "",
-            ]
+            side=side,
         )
-        angles_deg = make_circular([a for a in range(0, 360, 30)])
-        angles_rad = make_circular([a * math.pi / 180 for a in range(0, 360, 30)])
-
-        ax4 = plt.axes([0.1, 0.3, 0.25, 0.25], polar=True)
-        ax4.plot(angles_rad, attendance_all, "-", linewidth=1, color="#ff7f0e")
-        ax4.fill(angles_rad, attendance_all, alpha=0.15, zorder=2, color="#ff7f0e")
-        ax4.plot(angles_rad, attendance_this_year, "-", linewidth=1, color="#2ca02c")
-        ax4.fill(
-            angles_rad, attendance_this_year, alpha=0.15, zorder=3, color="#2ca02c"
-        )
-        ax4.spines["polar"].set_linestyle("--")
-        ax4.spines["polar"].set_linewidth(0.5)
-        ax4.spines["polar"].set_color("grey")
-        ax4.tick_params(axis="x", which="major", labelsize="xx-small", length=0)
-        ax4.tick_params(axis="y", which="major", labelsize="xx-small", length=0)
-        ax4.set_thetagrids(angles_deg, feature)
-        ax4.set_yticks([20, 40, 60, 80, 100])
-        ax4.set_yticklabels(["", "", "", "", "100%"])
-        ax4.set_ylim(0, 100)
-        ax4.grid(visible=True, lw=0.5, ls="--")
-
-        years = dts[-1].year - dts[0].year + 1
-        distance_this_year = sum(
-            [distances[i] for i, dt in enumerate(dts) if dt.year == this_year]
+        for body in parts["bodies"]:
+            body.set_facecolor(color)
+            body.set_edgecolor(color)
+            body.set_rasterized(rasterized)
+        parts["cmedians"].set_linewidth(1)
+        parts["cmedians"].set_color(color)
+        parts["cmeans"].set_linewidth(1)
+        parts["cmeans"].set_color(color)
+        parts["cmeans"].set_linestyle("--")
+
+    if stats_all is not None:
+        ax.set_xlim(stats_all["percentiles"])
+    ax.set_yticklabels([])
+    ax.spines[["top", "right", "left", "bottom"]].set_visible(False)
+    ax.tick_params(axis="x", which="major", labelsize="xx-small", length=2)
+    ax.tick_params(axis="y", which="major", labelsize="xx-small", length=0)
+
+
+def plot_attendance(ax, months: np.ndarray, rasterized: bool = False) -> None:
+    attendance_all, attendance_this_year = tuple(
+        map(make_circular, get_attendance(months))
+    )
+    feature = make_circular(
+        [
+            "Jan",
+            "",
+            "",
+            "Apr",
+            "",
+            "",
+            "Jul",
+            "",
+            "",
+            "Oct",
+            "",
+            "",
+        ]
+    )
+    angles_deg = make_circular([a for a in range(0, 360, 30)])
+    angles_rad = make_circular([a * math.pi / 180 for a in range(0, 360, 30)])
+
+    ax.plot(angles_rad, attendance_all, "-", linewidth=1, color="#ff7f0e")
+    ax.fill(
+        angles_rad,
+        attendance_all,
+        alpha=0.15,
+        zorder=2,
+        color="#ff7f0e",
+        rasterized=rasterized,
+    )
+    ax.plot(angles_rad, attendance_this_year, "-", linewidth=1, color="#2ca02c")
+    ax.fill(
+        angles_rad,
+        attendance_this_year,
+        alpha=0.15,
+        zorder=3,
+        color="#2ca02c",
+        rasterized=rasterized,
+    )
+    ax.spines["polar"].set_linestyle("--")
+    ax.spines["polar"].set_linewidth(0.5)
+    ax.spines["polar"].set_color("grey")
+    ax.tick_params(axis="x", which="major", labelsize="xx-small", length=0)
+    ax.tick_params(axis="y", which="major", labelsize="xx-small", length=0)
+    ax.set_thetagrids(angles_deg, feature)
+    ax.set_yticks([20, 40, 60, 80, 100])
+    ax.set_yticklabels(["", "", "", "", "100%"])
+    ax.set_ylim(0, 100)
+    ax.grid(visible=True, lw=0.5, ls="--")
+
+
+def get_summary(
+    runner: str,
+    years: np.ndarray,
+    latest: datetime,
+    latest_distance: float,
+    today: date,
+    records: Records,
+) -> str:
+    # 按年汇总的表里直接取，不用再扫一遍所有记录
+    distance_this_year = years["distance"][years["key"] == today.year].sum()
+    text = (
+        f"{runner}\n"
+        f"{years['key'][-1] - years['key'][0] + 1} years\n"
+        f"{years['count'].sum()} times\n"
+        f"total {years['distance'].sum():.2f}Km\n"
+        f"this year {distance_this_year:.2f}Km\n"
+        f"latest {latest: %Y-%m-%d} {latest_distance:.2f}Km"
+    )
+    if records.day is not None:
+        days = get_current_streak(records.day, today, "day")
+        weeks = get_current_streak(records.week, today, "week")
+        text += (
+            f"\nstreak {plural(days, 'day')} {plural(weeks, 'week')}"
+            f"\nlongest {plural(records.day.longest, 'day')} "
+            f"{plural(records.week.longest, 'week')}"
         )
-        fig.text(
-            0.97,
-            0.15,
-            f"{RUNNER}\n"
-            f"{years} years\n"
-            f"{len(dts)} times\n"
-            f"total {accs[-1]:.2f}Km\n"
-            f"this year {distance_this_year:.2f}Km\n"
-            f"latest {dts[-1]: %Y-%m-%d} {distances[-1]:.2f}Km",
-            ha="right",
-            va="bottom",
-            fontsize="small",
-            linespacing=1.5,
+    bests = [
+        f"{name} {best[0] // 60}'{best[0] % 60:02d}\""
+        for name, best in records.bests.items()
+        if best is not None
+    ]
+    if bests:
+        text += f"\nbest {' '.join(bests)}"
+    return text
+
+
+def plural(count: int, unit: str) -> str:
+    return f"{count} {unit}{'' if count == 1 else 's'}"
+
+
+def plot_summary(fig, text: str):
+    return fig.text(
+        0.97,
+        0.15,
+        text,
+        ha="right",
+        va="bottom",
+        fontsize="small",
+        linespacing=1.5,
+    )
+
+
+def plot_runner_image(ax, image: np.ndarray) -> None:
+    from matplotlib.offsetbox import AnnotationBbox, OffsetImage
+
+    ax.add_artist(
+        AnnotationBbox(
+            OffsetImage(image, zoom=0.03),
+            (0.95, 0.05),
+            xycoords="axes fraction",
+            frameon=False,
         )
-        img = plt.imread("runner.png")
-        ax.add_artist(
-            AnnotationBbox(
-                OffsetImage(img, zoom=0.03),
-                (0.95, 0.05),
-                xycoords="axes fraction",
-                frameon=False,
+    )
+
+
+def get_render_fingerprint(
+    runner: str = RUNNER,
+    csv_path: str = "running.csv",
+    points: int = POINT_BUDGET,
+    options: OutputOptions = OutputOptions(),
+    output: str = "miles.svg",
+    write: bool = True,
+) -> str:
+    import importlib.metadata
+
+    h = hashlib.sha1()
+    for column in load_running_log(csv_path, write):
+        h.update(column.tobytes())
+    # 今年的数据和连续跑步的天数都和今天是哪天有关
+    h.update(f"{runner}\n{date.today()}\n{points}\n".encode())
+    h.update(f"{options}\n{get_format(output)}\n".encode())
+    h.update(importlib.metadata.version("matplotlib").encode())
+    # 小提琴图的密度是FFT算的，numpy版本不同结果可能差最后几位
+    h.update(np.__version__.encode())
+    modules = [sys.modules[name].__file__ for name in RENDER_MODULES]
+    for path in (RUNNER_IMAGE, __file__, *modules):
+        with open(path, "rb") as f:
+            h.update(hashlib.sha1(f.read()).digest())
+    return h.hexdigest()
+
+
+def is_rendered(output: str, fingerprint: str) -> bool:
+    try:
+        with open(output, "rb") as f:
+            data = f.read()
+        if output.lower().endswith(".svgz"):
+            data = gzip.decompress(data)
+    except (OSError, EOFError, gzip.BadGzipFile):
+        return False
+    return f"fingerprint {fingerprint}".encode() in data
+
+
+def restore_render(csv_path: str, output: str, fingerprint: str) -> bool:
+    cached = os.path.join(get_cache_dir(csv_path), "render", fingerprint)
+    if not os.path.exists(cached):
+        return False
+    shutil.copyfile(cached, output)
+    os.utime(cached)
+    return True
+
+
+def save_render(csv_path: str, output: str, fingerprint: str) -> None:
+    render_dir = os.path.join(get_cache_dir(csv_path), "render")
+    os.makedirs(render_dir, exist_ok=True)
+    shutil.copyfile(output, os.path.join(render_dir, fingerprint))
+    # 按最近使用时间淘汰，只保留RENDER_CACHE_SIZE个
+    entries = sorted(
+        (os.path.join(render_dir, name) for name in os.listdir(render_dir)),
+        key=os.path.getmtime,
+    )
+    for path in entries[:-RENDER_CACHE_SIZE]:
+        os.remove(path)
+
+
+def render_job(runner: str, csv_path: str, output: str) -> tuple[float, Optional[str]]:
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        plot_running(runner, csv_path, output)
+    except Exception:
+        return time.perf_counter() - start, traceback.format_exc()
+    return time.perf_counter() - start, None
+
+
+def read_manifest(path: str) -> list[tuple[str, str, str]]:
+    # 每行是 runner,csv,output，相对路径相对于manifest所在的目录
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, newline="") as f:
+        for cols in csv.reader(f):
+            if not cols or cols[0].startswith("#") or cols[0] == "runner":
+                continue
+            runner, csv_path, output = [col.strip() for col in cols]
+            jobs.append(
+                (runner, os.path.join(base, csv_path), os.path.join(base, output))
             )
-        )
-        fig.savefig("miles.svg")
+    return jobs
+
+
+def batch_render(
+    jobs: list[tuple[str, str, str]], workers: Optional[int] = None
+) -> bool:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # matplotlib不是线程安全的，每个跑者在单独的进程里画，一个出错不影响其他的
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_job, *job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as err:
+                results[futures[future]] = (0.0, repr(err))
+    for job in jobs:
+        seconds, error = results[job]
+        status = "ok" if error is None else "FAILED"
+        print(f"{job[0]:<16} {status:<6} {seconds:>8.2f}s {job[2]}")
+    for job in jobs:
+        if results[job][1] is not None:
+            print(f"\n{job[0]} ({job[1]}):\n{results[job][1]}", file=sys.stderr)
+    failed = sum(error is not None for _, error in results.values())
+    print(f"{len(jobs) - failed} rendered, {failed} failed")
+    return not failed
 
 
 def pace_label_fmt(val: float, pos) -> str:
@@ -204,26 +782,33 @@ def make_circular(lst: list[T]) -> list[T]:
     return lst
 
 
-def get_attendance(dts: list[datetime]) -> tuple[list[float], list[float]]:
-    dts_all_monthly = groupby(dts, lambda d: d.month)
+def get_attendance(months: np.ndarray) -> tuple[list[float], list[float]]:
+    # months是按月汇总的表，key是从1970年1月开始的月数
+    years, month_index = np.divmod(months["key"], 12)
+    years += 1970
     this_year = datetime.now().year
-    dts_this_year = [d for d in dts if d.year == this_year]
-    dts_this_year_monthly = groupby(dts_this_year, lambda d: d.month)
+    is_this_year = years == this_year
+    runs_all_monthly = np.bincount(month_index, months["count"], 12).astype(int)
+    runs_this_year_monthly = np.bincount(
+        month_index[is_this_year], months["count"][is_this_year], 12
+    ).astype(int)
     days_all_monthly = get_days_monthly(
-        dts[0].year, dts[-1].year, dts[0].month, dts[-1].month
+        int(years[0]), int(years[-1]), int(month_index[0]) + 1, int(month_index[-1]) + 1
     )
     days_this_year_monthly = get_days_monthly(this_year, this_year)
     attendance_all = []
     attendance_this_year = []
     for m in range(1, 13):
-        if m in dts_all_monthly:
-            attendance_all.append(len(dts_all_monthly[m]) / days_all_monthly[m] * 100)
+        if runs_all_monthly[m - 1]:
+            attendance_all.append(
+                int(runs_all_monthly[m - 1]) / days_all_monthly[m] * 100
+            )
         else:
             attendance_all.append(0.0)
 
-        if m in dts_this_year_monthly:
+        if runs_this_year_monthly[m - 1]:
             attendance_this_year.append(
-                len(dts_this_year_monthly[m]) / days_this_year_monthly[m] * 100
+                int(runs_this_year_monthly[m - 1]) / days_this_year_monthly[m] * 100
             )
         else:
             attendance_this_year.append(0.0)
@@ -231,6 +816,35 @@ def get_attendance(dts: list[datetime]) -> tuple[list[float], list[float]]:
     return attendance_all, attendance_this_year
 
 
+def get_rolling_sums(daily: np.ndarray, window: int) -> np.ndarray:
+    # 前缀和相减，每天O(1)，和窗口大小无关
+    cumsum = np.concatenate(([0], np.cumsum(daily)))
+    end = np.arange(1, len(daily) + 1)
+    return cumsum[end] - cumsum[np.maximum(end - window, 0)]
+
+
+def get_training_load(days: np.ndarray) -> TrainingLoad:
+    # days是按天汇总的表，key是从1970-01-01开始的天数，补上没跑步的天
+    first = days["key"][0]
+    daily = np.zeros(days["key"][-1] - first + 1, dtype=np.int64)
+    # 按汇总表的精度换成整数累加，几十年的前缀和相减也没有浮点误差
+    scale = 10**DISTANCE_DECIMALS
+    daily[days["key"] - first] = np.round(days["distance"] * scale).astype(np.int64)
+    weekly = get_rolling_sums(daily, ACUTE_DAYS) / scale
+    acute = weekly / ACUTE_DAYS
+    chronic = get_rolling_sums(daily, CHRONIC_DAYS) / scale / CHRONIC_DAYS
+    ratio = np.divide(
+        acute, chronic, out=np.full(len(daily), np.nan), where=chronic > 0
+    )
+    return TrainingLoad(
+        np.arange(first, first + len(daily)).astype("datetime64[D]"),
+        weekly,
+        acute,
+        chronic,
+        ratio,
+    )
+
+
 def get_days_monthly(
     year_start: int,
     year_end: int,
@@ -251,56 +865,31 @@ def get_days_monthly(
     return days_monthly
 
 
-def groupby(data: list[T], key_func: Callable[[T], K]) -> dict[K, list[T]]:
-    grouped_data = {}
-    for item in data:
-        key = key_func(item)
-        if key in grouped_data:
-            grouped_data[key].append(item)
-        else:
-            grouped_data[key] = [item]
-    return grouped_data
-
-
-def get_running_data() -> tuple[
-    list[datetime], list[float], list[float], list[int], list[int]
-]:
-    data = []
-    with open("running.csv") as file:
-        for line in file:
-            cols = line.rstrip().split(",")
-            if cols[0] == "DT":
-                continue
-            dt = datetime.strptime(cols[0], "%Y-%m-%d %H:%M:%S")
-            distance = float(cols[1])
-            heart = int(cols[2]) if cols[2].isdecimal() else None
-            # garmin数据中配速为整分整秒时，比如6:00，传过来的原始值竟然是5:60
-            mins, secs = [int(i) for i in cols[3].split(":")]
-            if secs == 60:
-                mins = mins + 1
-                secs = 0
-            if distance <= 0.0:
-                continue
-            data.append((dt, distance, heart, mins * 60 + secs))
-    data.sort(key=lambda t: t[0])
-    acc = 0.0
-    dts = []
-    accs = []
-    distances = []
-    hearts = []
-    paces = []
-    for idx, (dt, distance, heart, pace) in enumerate(data):
-        acc += distance
-        dts.append(dt)
-        accs.append(acc)
-        distances.append(distance)
-        if heart:
-            hearts.append(heart)
-        paces.append(pace)
-    return dts, accs, distances, hearts, paces
-
-
-def sync_data(dt_str: str, distance_str: str, heart_str: str, pace_str: str) -> bool:
+def get_running_data(
+    csv_path: str = "running.csv",
+) -> tuple[list[datetime], list[float], list[float], list[int], list[int]]:
+    with profiler.stage("get_running_data") as record:
+        log = load_running_log(csv_path)
+        record["rows"] = len(log.dt)
+        distances = get_distances(log)
+        # cumsum是按顺序累加的，和逐行相加的结果一样
+        accs = np.cumsum(distances)
+        return (
+            log.dt.tolist(),
+            accs.tolist(),
+            distances.tolist(),
+            log.heart[log.heart_mask].tolist(),
+            log.pace.tolist(),
+        )
+
+
+def sync_data(
+    dt_str: str,
+    distance_str: str,
+    heart_str: str,
+    pace_str: str,
+    dry_run: bool = False,
+) -> bool:
     dt_strs = dt_str.split(",")
     distances = distance_str.split(",")
     hearts = heart_str.split(",")
@@ -315,43 +904,219 @@ def sync_data(dt_str: str, distance_str: str, heart_str: str, pace_str: str) ->
     elif len(paces) != n:
         print("pace length not equal dt length")
         return False
-    dts, _, _, _, _ = get_running_data()
-    if dts:
-        latest = dts[-1]
-        new_data = [
-            (dt_str, distances[i], hearts[i], paces[i])
-            for i, dt_str in enumerate(dt_strs)
-            if datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S") > latest
-        ]
-        if new_data:
-            with open("running.csv", "a") as f:
-                for dt_str, distance, heart, pace in sorted(
-                    new_data, key=lambda t: t[0]
-                ):
-                    f.write(f"{dt_str},{distance},{heart},{pace}\n")
-        else:
+    with profiler.stage("sync_data") as record:
+        # 只是看看会同步什么时，连缓存也不写
+        log = load_running_log("running.csv", write=not dry_run)
+        rows = {}
+        for i, dt_str in enumerate(dt_strs):
+            dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
+            rows.setdefault(dt, f"{dt_str},{distances[i]},{hearts[i]},{paces[i]}")
+        incoming = np.array(sorted(rows), dtype="datetime64[s]")
+        incoming = incoming[~contains_timestamps(log, incoming)]
+        if not len(incoming):
             print("no new data")
             return False
-    else:
-        with open("running.csv", "a") as f:
-            for i, dt_str in enumerate(dt_strs):
-                f.write(f"{dt_str},{distances[i]},{hearts[i]},{paces[i]}\n")
-    return True
+        lines = [rows[dt] for dt in incoming.tolist()]
+        record["rows"] = len(lines)
+        # 第二块手表晚上传的记录可能比已有的最新记录还早，要插入到正确的位置
+        merge = len(log.dt) and incoming[0] < log.dt[-1]
+        if dry_run:
+            for line in lines:
+                print(f"would {'merge' if merge else 'append'} {line}")
+        elif merge:
+            merge_running_lines("running.csv", lines)
+        else:
+            append_running_lines("running.csv", lines)
+        if not dry_run:
+            # 追加时只看新的几行，插入到中间时才整个重建
+            load_records("running.csv")
+        return True
+
+
+def decode_batch(batch: str) -> tuple[str, str, str, str, bool]:
+    """
+    Decode a batch sent by syncer/garmin.py back to comma separated dt, distance,
+    heart and pace, plus whether it is the last batch of the sync.
+    A batch is "1.<final>.<urlsafe base64 of zlib compressed text>", the text has
+    one line of integers per column: the first timestamp in epoch seconds then
+    deltas, distance in 1/100 km, heart rate with 0 for blank, pace as
+    minutes * 100 + seconds so 5:60 survives.
+    """
+    version, final, data = batch.strip().split(".", 2)
+    if version != "1":
+        raise ValueError(f"unknown batch version {version}")
+    text = zlib.decompress(base64.urlsafe_b64decode(data)).decode()
+    deltas, distances, hearts, paces = (
+        [int(v) for v in line.split(",")] if line else [] for line in text.split("\n")
+    )
+    timestamps = np.cumsum(deltas, dtype=np.int64).astype("datetime64[s]")
+    return (
+        ",".join(f"{dt:%Y-%m-%d %H:%M:%S}" for dt in timestamps.tolist()),
+        ",".join(f"{d // 100}.{d % 100:02d}" for d in distances),
+        ",".join(str(h) if h else "" for h in hearts),
+        ",".join(f"{p // 100}:{p % 100:02d}" for p in paces),
+        final == "1",
+    )
 
 
 if __name__ == "__main__":
-    args = sys.argv
-    if len(args) < 2:
-        sys.exit(
-            "args is not right, e.g. python main.py http 2022-01-02 12:00:21 140 4:56"
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "op",
+        choices=["http", "push", "check", "batch", "serve", "merge"],
+        help="http: sync data then plot, push: plot, check: same as --dry-run, "
+        "batch: plot every runner in a manifest, "
+        "serve: serve the chart over http and redraw it when the log changes, "
+        "merge: merge running logs of several sources into one",
+    )
+    parser.add_argument(
+        "data",
+        nargs="*",
+        help="comma separated dt, distance, heart and pace, "
+        "e.g. '2022-01-02 12:00:21' 5.12 140 4:56, "
+        "or for batch a manifest file with runner,csv,output lines, "
+        "or for serve the running log, defaults to running.csv, "
+        "or for merge the time sorted running logs, the first one wins duplicates",
+    )
+    parser.add_argument(
+        "--batch",
+        help="for http, an encoded batch from the syncer instead of data, "
+        "only the final batch of a sync is plotted",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="worker processes for batch, defaults to the number of cpus",
+    )
+    parser.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        help="report what would be synced and whether a re-render is required",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="report wall time, cpu time, allocated bytes and rows of every stage",
+    )
+    parser.add_argument("--cprofile", help="dump a cProfile of the render to this file")
+    parser.add_argument(
+        "--points",
+        type=int,
+        default=POINT_BUDGET,
+        help="most points drawn for the cumulative distance line",
+    )
+    parser.add_argument(
+        "--format",
+        dest="formats",
+        action="append",
+        choices=OUTPUT_FORMATS,
+        help="write miles.<format>, repeat for several formats, defaults to svg",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help=f"round svg coordinates to {OPTIMIZED_PRECISION} decimals "
+        "and store repeated embedded images once",
+    )
+    parser.add_argument(
+        "--precision", type=int, help="decimals kept in svg coordinates"
+    )
+    parser.add_argument(
+        "--rasterize",
+        action="store_true",
+        help="draw the violin and attendance fills as bitmaps",
+    )
+    parser.add_argument(
+        "--dpi", type=int, default=100, help="resolution of png, webp and bitmaps"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address serve listens on")
+    parser.add_argument("--port", type=int, default=8000, help="port serve listens on")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between checks of the running log for serve",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="for merge, runs of two sources starting within this many seconds "
+        "are the same run, defaults to 60",
+    )
+    parser.add_argument(
+        "--output", default="running.csv", help="for merge, the merged running log"
+    )
+    options = parser.parse_args()
+    outputs = [f"miles.{fmt}" for fmt in options.formats or ["svg"]]
+    precision = options.precision
+    if precision is None and options.optimize:
+        precision = OPTIMIZED_PRECISION
+    output_options = OutputOptions(
+        precision, options.optimize, options.rasterize, options.dpi
+    )
+    if options.profile:
+        profiler.enable()
+    if options.cprofile:
+        profiler.cprofile_path = options.cprofile
+    if options.op == "batch":
+        if len(options.data) != 1:
+            parser.error("batch needs a manifest file")
+        sys.exit(0 if batch_render(read_manifest(options.data[0]), options.jobs) else 1)
+    if options.op == "serve":
+        if len(options.data) > 1:
+            parser.error("serve takes at most one running log")
+        serve_running(
+            csv_path=options.data[0] if options.data else "running.csv",
+            formats=options.formats or ["svg"],
+            points=options.points,
+            options=output_options,
+            host=options.host,
+            port=options.port,
+            interval=options.interval,
+        )
+        sys.exit(0)
+    if options.op == "merge":
+        if not options.data:
+            parser.error("merge needs at least one running log")
+        from merge import TOLERANCE_SECONDS, merge_sources
+
+        tolerance = options.tolerance
+        if tolerance is None:
+            tolerance = TOLERANCE_SECONDS
+        with profiler.stage("merge") as record:
+            stats = merge_sources(options.data, options.output, tolerance)
+            record["rows"] = stats.read
+        print(
+            f"merged {stats.read} runs of {len(options.data)} sources into "
+            f"{options.output}, {stats.written} written, "
+            f"{stats.duplicates} duplicates dropped"
         )
-    op = args[1]
-    if op != "http" and op != "push":
-        sys.exit("op must be http or push")
-    if op == "http":
-        if sync_data(args[2], args[3], args[4], args[5]):
-            plot_running()
-    elif op == "push":
-        plot_running()
+        profiler.report()
+        sys.exit(0)
+    dry_run = options.dry_run or options.op == "check"
+    final = True
+    if options.batch:
+        if options.data:
+            parser.error("pass either data or --batch")
+        *options.data, final = decode_batch(options.batch)
+    if len(options.data) not in (0, 4) or options.op == "http" and not options.data:
+        parser.error("data must be dt, distance, heart and pace")
+    synced = bool(options.data) and sync_data(*options.data, dry_run=dry_run)
+    if not dry_run:
+        # 分批同步时只在最后一批画图，前面几批的新数据也要画上，画过了会自动跳过
+        if options.op != "http" or final and (synced or options.batch):
+            plot_running(output=outputs, points=options.points, options=output_options)
     else:
-        sys.exit("args is not right, e.g. python main.py http 2022-01-02 12:00:21")
+        for output in outputs:
+            fingerprint = get_render_fingerprint(
+                points=options.points,
+                options=output_options,
+                output=output,
+                write=False,
+            )
+            if synced or not is_rendered(output, fingerprint):
+                print(f"{output} needs re-render")
+            else:
+                print(f"{output} is up to date")
+    profiler.report()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Merge running logs from several sources (the garmin syncer, running_page, a
+garmin export) into one running.csv.
+Every source is a csv in the format of running.csv sorted by time. The sources
+are read line by line and merged through a heap, and runs of different sources
+that start within a tolerance of each other are the same run recorded twice, of
+which the one from the source given first is kept. Only one line per source and
+the runs of the last tolerance seconds are held in memory, and the result is
+written to a temp file that replaces the output when complete.
+"""
+
+import heapq
+import os
+from collections import deque
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple
+
+from store import invalidate_cache
+
+HEADER = "DT,distance(Km),heart,pace"
+# 不同设备和平台记录的开始时间会差几秒到几十秒
+TOLERANCE_SECONDS = 60
+
+
+class MergeStats(NamedTuple):
+    read: int
+    written: int
+    duplicates: int
+
+
+def read_source(path: str, source: int) -> Iterator[tuple[str, int, str]]:
+    """
+    Yield (dt, source, line) for every run in a time sorted running log
+    """
+    with open(path) as f:
+        last = ""
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("DT,"):
+                continue
+            dt = line.split(",", 1)[0]
+            if dt < last:
+                raise ValueError(f"{path}:{number} is earlier than the line before")
+            last = dt
+            yield dt, source, line
+
+
+class Run:
+    """
+    A run recorded by one or more sources, kept while more sources may still
+    report it
+    """
+
+    def __init__(self, dt: str, source: int, line: str):
+        self.dt = dt
+        self.start = datetime.fromisoformat(dt)
+        # 来源 -> 这个来源记录的开始时间
+        self.sources = {source: dt}
+        self.best = (source, dt, line)
+
+    def add(self, dt: str, source: int, line: str) -> bool:
+        """
+        Add the record of a source if it can be this run, a source records a run
+        once, or twice with exactly the same start time
+        """
+        if self.sources.get(source, dt) != dt:
+            return False
+        self.sources[source] = dt
+        self.best = min(self.best, (source, dt, line))
+        return True
+
+    def kept(self) -> tuple[str, int, str]:
+        source, dt, line = self.best
+        return dt, source, line
+
+
+def dedup_runs(runs: Iterable[tuple[str, int, str]], tolerance: float) -> Iterator[str]:
+    """
+    Lines of time sorted (dt, source, line) runs without duplicates, a run is a
+    duplicate of the earliest open run that started at most tolerance seconds
+    before it and has no record of its source yet
+    """
+    window: deque[Run] = deque()
+    # 已经不会再有重复的记录，保留的那条可能比后面的开始时间晚，排好序再输出
+    closed: list[tuple[str, int, str]] = []
+    for dt, source, line in runs:
+        start = datetime.fromisoformat(dt)
+        while window and (start - window[0].start).total_seconds() > tolerance:
+            heapq.heappush(closed, window.popleft().kept())
+        # 还开着的和以后的记录都不会早于这个时间
+        earliest = min(window[0].dt, dt) if window else dt
+        while closed and closed[0][0] < earliest:
+            yield heapq.heappop(closed)[2]
+        if not any(run.add(dt, source, line) for run in window):
+            window.append(Run(dt, source, line))
+    for run in window:
+        heapq.heappush(closed, run.kept())
+    while closed:
+        yield heapq.heappop(closed)[2]
+
+
+def merge_sources(
+    sources: list[str],
+    output: str = "running.csv",
+    tolerance: float = TOLERANCE_SECONDS,
+) -> MergeStats:
+    """
+    Merge the running logs in sources into output, when two sources recorded the
+    same run the one given first wins, output may be one of the sources
+    """
+    read = 0
+
+    def counted(runs: Iterator[tuple[str, int, str]]) -> Iterator[tuple[str, int, str]]:
+        nonlocal read
+        for run in runs:
+            read += 1
+            yield run
+
+    written = 0
+    tmp = f"{output}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(f"{HEADER}\n")
+            # 比较(dt, 来源序号, 行)，同一时间的记录按来源的先后出来
+            runs = heapq.merge(
+                *(read_source(path, i) for i, path in enumerate(sources))
+            )
+            for line in dedup_runs(counted(runs), tolerance):
+                f.write(f"{line}\n")
+                written += 1
+        os.replace(tmp, output)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # 重写过的文件可能和缓存的尾部哈希碰巧一样，不能当成只追加了行
+    invalidate_cache(output)
+    return MergeStats(read, written, read - written)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Streaks and personal bests of running.csv, kept in a small json file next to the
+columnar cache. While rows are only appended to the log (the generation of the
+cache is unchanged) the stored state is carried forward over the new rows only,
+after an out of order insert it is rebuilt from all rows at once.
+A daily streak is consecutive days with a run and a weekly streak consecutive ISO
+weeks with a run. The stored streaks end at the latest run, get_current_streak
+tells whether they are still going on a given day. The best pace of a distance
+is the fastest run at least that long.
+"""
+
+import json
+import os
+from datetime import date
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from rollup import get_keys
+from store import (
+    RunningLog,
+    get_cache_dir,
+    get_distances,
+    get_generation,
+    load_running_log,
+)
+
+RECORDS_VERSION = 1
+# 5公里、10公里、半马
+DISTANCES = {"5k": 5.0, "10k": 10.0, "half": 21.0975}
+
+
+class Streak(NamedTuple):
+    # 最后一次跑步所在的天或者周，见rollup.get_keys
+    last: int
+    current: int
+    longest: int
+
+
+class Records(NamedTuple):
+    day: Optional[Streak]
+    week: Optional[Streak]
+    # 距离 -> (每公里配速秒数, 开始时间)，没有跑过这么远时是None
+    bests: dict[str, Optional[tuple[int, str]]]
+
+
+def get_lengths(keys: np.ndarray, step: int) -> np.ndarray:
+    """
+    Lengths of the runs of consecutive keys, keys are sorted and unique
+    """
+    breaks = np.flatnonzero(np.diff(keys) != step) + 1
+    return np.diff(np.concatenate(([0], breaks, [len(keys)])))
+
+
+def extend_streak(
+    streak: Optional[Streak], keys: np.ndarray, step: int
+) -> Optional[Streak]:
+    """
+    Carry streak forward over the sorted keys of new runs, none of them earlier
+    than streak.last
+    """
+    keys = np.unique(keys)
+    if streak is not None:
+        keys = keys[keys > streak.last]
+    if not len(keys):
+        return streak
+    if streak is None:
+        lengths = get_lengths(keys, step)
+    else:
+        # 第一段和原来的连续接在一起算，原来的最后一天算了两次
+        lengths = get_lengths(np.concatenate(([streak.last], keys)), step)
+        lengths[0] += streak.current - 1
+    longest = max(int(lengths.max()), streak.longest if streak else 0)
+    return Streak(int(keys[-1]), int(lengths[-1]), longest)
+
+
+def extend_bests(
+    bests: dict[str, Optional[tuple[int, str]]], log: RunningLog
+) -> dict[str, Optional[tuple[int, str]]]:
+    distance = get_distances(log)
+    bests = dict(bests)
+    for name, km in DISTANCES.items():
+        candidates = np.flatnonzero((distance >= km) & (log.pace > 0))
+        if not len(candidates):
+            continue
+        # 配速一样时保留最早的，和整体重建的结果一致
+        i = candidates[log.pace[candidates].argmin()]
+        if bests.get(name) is None or log.pace[i] < bests[name][0]:
+            bests[name] = (int(log.pace[i]), str(log.dt[i]).replace("T", " "))
+    return bests
+
+
+def get_current_streak(streak: Optional[Streak], day: date, level: str) -> int:
+    """
+    Length of the streak still going on day, a streak is going while day is in the
+    period of its last run or the period right after it
+    """
+    step = 1 if level == "day" else 7
+    key = int(get_keys(np.array([day], dtype="M8[D]"), level)[0])
+    if streak is None or key - streak.last > step:
+        return 0
+    return streak.current
+
+
+def update_records(records: Optional[Records], log: RunningLog) -> Records:
+    """
+    Records of the rows before log plus log, or of log alone when records is None
+    """
+    if records is None:
+        records = Records(None, None, {name: None for name in DISTANCES})
+    return Records(
+        extend_streak(records.day, get_keys(log.dt, "day"), 1),
+        extend_streak(records.week, get_keys(log.dt, "week"), 7),
+        extend_bests(records.bests, log),
+    )
+
+
+def load_records(csv_path: str) -> Records:
+    log = load_running_log(csv_path)
+    generation = get_generation(csv_path)
+    path = os.path.join(get_cache_dir(csv_path), "records.json")
+    state = _read(path)
+    records, rows = None, 0
+    if state and state["generation"] == generation and state["rows"] <= len(log.dt):
+        records, rows = _to_records(state), state["rows"]
+        if rows == len(log.dt):
+            return records
+    records = update_records(records, RunningLog(*(column[rows:] for column in log)))
+    _write(path, records, generation, len(log.dt))
+    return records
+
+
+def _to_records(state: dict) -> Records:
+    def streak(value: Optional[list]) -> Optional[Streak]:
+        return value and Streak(*value)
+
+    bests = {name: value and tuple(value) for name, value in state["bests"].items()}
+    return Records(streak(state["day"]), streak(state["week"]), bests)
+
+
+def _read(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("version") == RECORDS_VERSION else None
+
+
+def _write(path: str, records: Records, generation: str, rows: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    state = {
+        "version": RECORDS_VERSION,
+        "generation": generation,
+        "rows": rows,
+        **records._asdict(),
+    }
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
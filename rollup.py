@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-aggregated totals of running.csv per day, ISO week, month and year.
+Every level is a table of run count, distance, heart rate sum and count and pace
+sum per period, built with bincount and kept next to the columnar cache. When
+rows were only appended to the log, just the new rows are aggregated and added.
+Keys are days since 1970-01-01 for days, the day of the Monday for weeks,
+months since 1970-01 for months and the calendar year for years.
+"""
+
+import json
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from store import (
+    RunningLog,
+    get_cache_dir,
+    get_distances,
+    get_generation,
+    load_running_log,
+)
+
+ROLLUP_VERSION = 2
+# 距离的和保留到1e-6Km，足够放下csv里的小数位，又能抹掉累加顺序带来的浮点误差，
+# 增量更新和整体重建的结果完全一样
+DISTANCE_DECIMALS = 6
+ROLLUP_DTYPE = np.dtype(
+    [
+        ("key", "<i8"),
+        ("count", "<i8"),
+        ("distance", "<f8"),
+        ("heart_sum", "<i8"),
+        ("heart_count", "<i8"),
+        ("pace_sum", "<i8"),
+    ]
+)
+LEVELS = ("day", "week", "month", "year")
+
+
+class Rollup(NamedTuple):
+    day: np.ndarray
+    week: np.ndarray
+    month: np.ndarray
+    year: np.ndarray
+
+
+def get_keys(dt: np.ndarray, level: str) -> np.ndarray:
+    if level == "day":
+        return dt.astype("M8[D]").astype(np.int64)
+    if level == "week":
+        days = dt.astype("M8[D]").astype(np.int64)
+        # 1970-01-01是星期四
+        return days - (days + 3) % 7
+    if level == "month":
+        return dt.astype("M8[M]").astype(np.int64)
+    return dt.astype("M8[Y]").astype(np.int64) + 1970
+
+
+def aggregate(keys: np.ndarray, values: dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Sum values per key into a rollup table sorted by key
+    """
+    unique, inverse = np.unique(keys, return_inverse=True)
+    table = np.zeros(len(unique), dtype=ROLLUP_DTYPE)
+    table["key"] = unique
+    for name, weights in values.items():
+        sums = np.bincount(inverse, weights=weights, minlength=len(unique))
+        table[name] = np.round(sums, DISTANCE_DECIMALS) if name == "distance" else sums
+    return table
+
+
+def build_rollup(log: RunningLog) -> Rollup:
+    values = {
+        "count": np.ones(len(log.dt)),
+        "distance": get_distances(log),
+        "heart_sum": np.where(log.heart_mask, log.heart, 0).astype(np.float64),
+        "heart_count": log.heart_mask.astype(np.float64),
+        "pace_sum": log.pace.astype(np.float64),
+    }
+    return Rollup(*(aggregate(get_keys(log.dt, level), values) for level in LEVELS))
+
+
+def combine(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+    both = np.concatenate([old, new])
+    names = [name for name in ROLLUP_DTYPE.names if name != "key"]
+    return aggregate(both["key"], {name: both[name] for name in names})
+
+
+def load_rollup(csv_path: str) -> Rollup:
+    log = load_running_log(csv_path)
+    generation = get_generation(csv_path)
+    rollup_dir = os.path.join(get_cache_dir(csv_path), "rollup")
+    meta = _read_meta(rollup_dir)
+    if meta and meta["generation"] == generation and meta["rows"] <= len(log.dt):
+        rollup = _read_tables(rollup_dir)
+        if rollup is not None and meta["rows"] == len(log.dt):
+            return rollup
+        if rollup is not None:
+            new = build_rollup(RunningLog(*(column[meta["rows"] :] for column in log)))
+            rollup = Rollup(*(combine(old, add) for old, add in zip(rollup, new)))
+            _write(rollup_dir, rollup, generation, len(log.dt))
+            return rollup
+    rollup = build_rollup(log)
+    _write(rollup_dir, rollup, generation, len(log.dt))
+    return rollup
+
+
+def _read_meta(rollup_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(rollup_dir, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("version") == ROLLUP_VERSION else None
+
+
+def _read_tables(rollup_dir: str) -> Optional[Rollup]:
+    try:
+        tables = [np.load(os.path.join(rollup_dir, f"{level}.npy")) for level in LEVELS]
+    except (OSError, ValueError):
+        return None
+    if any(table.dtype != ROLLUP_DTYPE for table in tables):
+        return None
+    return Rollup(*tables)
+
+
+def _write(rollup_dir: str, rollup: Rollup, generation: str, rows: int) -> None:
+    os.makedirs(rollup_dir, exist_ok=True)
+    for level, table in zip(LEVELS, rollup):
+        tmp = os.path.join(rollup_dir, f"{level}.{os.getpid()}.tmp.npy")
+        np.save(tmp, table)
+        os.replace(tmp, os.path.join(rollup_dir, f"{level}.npy"))
+    meta = {"version": ROLLUP_VERSION, "generation": generation, "rows": rows}
+    tmp = os.path.join(rollup_dir, f"meta.json.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(rollup_dir, "meta.json"))
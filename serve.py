@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Serve rendered charts over http and re-render them when the running log changes.
+Every file has its render fingerprint as ETag and is only rendered when it is
+first asked for after a change, so clients polling with If-None-Match get a 304
+without any rendering until the chart really changed, and formats nobody asks for
+cost nothing. The log is watched by polling its mtime and size, which works
+everywhere without inotify, and the chart is also updated when the date changes,
+since this year's panels and the current streak depend on it.
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, NamedTuple, Optional
+
+CONTENT_TYPES = {
+    "svg": "image/svg+xml",
+    "svgz": "image/svg+xml",
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+
+class ServedFile(NamedTuple):
+    name: str
+    etag: str
+    content_type: str
+    encoding: Optional[str]
+    render: Callable[[], bytes]
+
+
+class ChartHandler(BaseHTTPRequestHandler):
+    server: "ChartServer"
+
+    def do_GET(self) -> None:
+        self.send_file(head=False)
+
+    def do_HEAD(self) -> None:
+        self.send_file(head=True)
+
+    def send_file(self, head: bool) -> None:
+        served = self.server.files.get(self.path.split("?", 1)[0])
+        if served is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        # If-None-Match可能带多个ETag，也可能是*
+        tags = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]
+        if served.etag in tags or "*" in tags:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", served.etag)
+            self.end_headers()
+            return
+        data = self.server.get_data(served)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", served.content_type)
+        if served.encoding:
+            self.send_header("Content-Encoding", served.encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", served.etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class ChartServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int]):
+        super().__init__(address, ChartHandler)
+        # 更新图和渲染文件都要拿着这个锁，matplotlib不是线程安全的
+        self.lock = threading.Lock()
+        # 整个替换这个字典，请求线程读到的总是完整的一组文件
+        self.files: dict[str, ServedFile] = {}
+        self.rendered: dict[str, bytes] = {}
+
+    def publish(self, files: dict[str, tuple[str, Callable[[], bytes]]]) -> None:
+        """
+        Serve files as /<name>, given as name -> (fingerprint, render), call it
+        while holding lock
+        """
+        served = {}
+        for name, (fingerprint, render) in files.items():
+            fmt = os.path.splitext(name)[1][1:]
+            served[f"/{name}"] = ServedFile(
+                name,
+                f'"{fingerprint}"',
+                CONTENT_TYPES[fmt],
+                "gzip" if fmt == "svgz" else None,
+                render,
+            )
+        etags = {file.etag for file in served.values()}
+        self.rendered = {
+            etag: data for etag, data in self.rendered.items() if etag in etags
+        }
+        self.files = served
+
+    def get_data(self, served: ServedFile) -> bytes:
+        with self.lock:
+            if served.etag not in self.rendered:
+                start = time.perf_counter()
+                self.rendered[served.etag] = served.render()
+                seconds = time.perf_counter() - start
+                print(f"rendered {served.name} in {seconds:.3f}s")
+            return self.rendered[served.etag]
+
+
+def get_state(path: str, today: date) -> Optional[tuple[int, int, date]]:
+    """
+    Everything the chart depends on besides the rows: the mtime and size of path
+    and the date, None while path is missing
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    # 跨年以后今年的数据变了，跨天以后连续跑步的天数也会变
+    return stat.st_mtime_ns, stat.st_size, today
+
+
+def watch(
+    path: str,
+    interval: float,
+    on_change: Callable[[], None],
+    stop: Optional[threading.Event] = None,
+) -> None:
+    """
+    Call on_change now and whenever the state of path changes until stop is set,
+    an error in on_change is printed and retried at the next change
+    """
+    stop = stop or threading.Event()
+    last = None
+    while not stop.is_set():
+        state = get_state(path, date.today())
+        if state is not None and state != last:
+            last = state
+            try:
+                on_change()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+        stop.wait(interval)
+
+
+def serve(
+    update: Callable[[], dict[str, tuple[str, Callable[[], bytes]]]],
+    path: str,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    interval: float = 1.0,
+) -> None:
+    """
+    Serve the files returned by update, update again whenever path changes
+    """
+    server = ChartServer((host, port))
+
+    def on_change() -> None:
+        with server.lock:
+            server.publish(update())
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"serving on http://{host}:{server.server_port}/, watching {path}")
+    try:
+        watch(path, interval, on_change)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar binary cache for running.csv.
+Every column is a raw little-endian array file that can be memory-mapped, the
+cache is validated against the csv inode, size, mtime and a hash of its tail, and
+extended in place when rows are appended to the csv. The sorted timestamp column
+doubles as the index used to tell which incoming runs are already stored.
+"""
+
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+CACHE_VERSION = 4
+TAIL_BYTES = 4096
+# 数组解析时每个字段最多取这么多字节，更长的字段逐行解析，一个超长的字段不会让
+# 整列的下标矩阵跟着变大
+MAX_FIELD_BYTES = 24
+COLUMNS = {
+    "dt": np.dtype("<M8[s]"),
+    # float64和float()的结果完全一样，小数位数不限
+    "distance": np.dtype("<f8"),
+    "heart": np.dtype("<u2"),
+    "heart_mask": np.dtype("?"),
+    "pace": np.dtype("<u2"),
+}
+_SPACES = np.frombuffer(b" \t\r\x0b\x0c", dtype=np.uint8)
+# 2019-03-29 21:49:01 中数字和分隔符的位置
+_DT_DIGITS = np.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18])
+_DT_SEPARATORS = np.array([4, 7, 10, 13, 16])
+_DT_SEPARATOR_CHARS = np.frombuffer(b"-- ::", dtype=np.uint8)
+
+
+class RunningLog(NamedTuple):
+    dt: np.ndarray
+    distance: np.ndarray
+    heart: np.ndarray
+    heart_mask: np.ndarray
+    pace: np.ndarray
+
+
+def get_cache_dir(csv_path: str) -> str:
+    head, name = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(head, f".{name}.cache")
+
+
+def get_distances(log: RunningLog) -> np.ndarray:
+    """
+    Distance of every run in km, the same values float() gives for the csv
+    """
+    return log.distance.astype(np.float64, copy=False)
+
+
+def parse_running_csv(data: bytes) -> RunningLog:
+    """
+    Parse the whole csv at once, every column is decoded as an array,
+    rows off the fast path fall back to strptime/float/int one by one
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord("\n"))
+    if len(buf) and buf[-1] != ord("\n"):
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate(([0], ends[:-1] + 1))[: len(ends)].astype(np.int64)
+    # 相当于逐行rstrip，只循环行尾空白的最大长度次
+    while True:
+        strip = (ends > starts) & np.isin(buf[np.maximum(ends - 1, 0)], _SPACES)
+        if not strip.any():
+            break
+        ends[strip] -= 1
+    keep = ends > starts
+    commas = np.flatnonzero(buf == ord(","))
+    first = np.searchsorted(commas, starts)
+    head = _field_ends(commas, first, ends)
+    second = buf[np.minimum(starts + 1, len(buf) - 1)]
+    keep &= ~((head - starts == 2) & (buf[starts] == ord("D")) & (second == ord("T")))
+    starts, ends, first = starts[keep], ends[keep], first[keep]
+    if not len(starts):
+        return RunningLog(*(np.empty(0, dtype=dtype) for dtype in COLUMNS.values()))
+    short = _field_ends(commas, first + 2, ends) == ends
+    if short.any():
+        line = int(np.flatnonzero(short)[0])
+        raise ValueError(f"not enough columns: {data[starts[line]:ends[line]]!r}")
+    fields = [
+        (starts, commas[first]),
+        (commas[first] + 1, commas[first + 1]),
+        (commas[first + 1] + 1, commas[first + 2]),
+        (commas[first + 2] + 1, _field_ends(commas, first + 3, ends)),
+    ]
+
+    dt = _parse_datetimes(data, buf, *fields[0])
+    distance = _parse_floats(data, buf, *fields[1])
+    heart, heart_ok, _ = _parse_decimals(buf, *fields[2])
+    # 比如补了很多0的心率，数组解析不了，按逐行解析的isdecimal/int()处理
+    for i in np.flatnonzero(~heart_ok & (fields[2][1] - fields[2][0] > 15)):
+        text = data[fields[2][0][i] : fields[2][1][i]].decode()
+        if text.isdecimal():
+            # 太大的值交给下面的范围检查报错
+            heart[i] = min(int(text), np.iinfo(np.int64).max)
+            heart_ok[i] = True
+    heart_mask = heart_ok & (heart != 0)
+    pace = _parse_paces(data, buf, *fields[3])
+    # 存不下的值不能截断或者回绕，直接报错
+    for name, column in (("heart", np.where(heart_mask, heart, 0)), ("pace", pace)):
+        bad = (column < 0) | (column > np.iinfo(COLUMNS[name]).max)
+        if bad.any():
+            line = int(np.flatnonzero(bad)[0])
+            raise ValueError(f"{name} out of range: {data[starts[line]:ends[line]]!r}")
+
+    order = np.argsort(dt, kind="stable")
+    order = order[distance[order] > 0.0]
+    return RunningLog(
+        dt[order].astype(COLUMNS["dt"]),
+        distance[order].astype(COLUMNS["distance"]),
+        np.where(heart_mask, heart, 0)[order].astype(COLUMNS["heart"]),
+        heart_mask[order],
+        pace[order].astype(COLUMNS["pace"]),
+    )
+
+
+def load_running_log(csv_path: str, write: bool = True) -> RunningLog:
+    """
+    Columns of the csv from the cache, rows appended since are parsed and added
+    to it, anything else parses the whole csv again. With write False the cache
+    is only read, e.g. for a dry run
+    """
+    cache_dir = get_cache_dir(csv_path)
+    meta = _read_meta(cache_dir)
+    with open(csv_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        # 整个文件重写时都是写临时文件再替换，inode变了就不能当成追加
+        if (
+            meta
+            and meta["inode"] == stat.st_ino
+            and meta["size"] <= stat.st_size
+            and _tail_hash(f, meta["size"]) == meta["tail"]
+        ):
+            log = _open_columns(cache_dir, meta["rows"])
+            if log is not None and meta["size"] == stat.st_size:
+                if meta["mtime_ns"] == stat.st_mtime_ns:
+                    return log
+            elif log is not None and meta["newline"]:
+                f.seek(meta["size"])
+                new = parse_running_csv(f.read())
+                if not len(log.dt) or not len(new.dt) or new.dt[0] >= log.dt[-1]:
+                    if not write:
+                        return RunningLog(*map(np.concatenate, zip(log, new)))
+                    _append_columns(cache_dir, meta["rows"], new)
+                    _write_meta(
+                        cache_dir,
+                        f,
+                        meta["rows"] + len(new.dt),
+                        meta["generation"],
+                    )
+                    return _open_columns(cache_dir, meta["rows"] + len(new.dt))
+        f.seek(0)
+        log = parse_running_csv(f.read())
+        if not write:
+            return log
+        os.makedirs(cache_dir, exist_ok=True)
+        _append_columns(cache_dir, 0, log)
+        _write_meta(cache_dir, f, len(log.dt))
+    return log
+
+
+def get_generation(csv_path: str) -> Optional[str]:
+    """
+    Id of the cached columns, it stays the same while rows are only appended
+    """
+    meta = _read_meta(get_cache_dir(csv_path))
+    return meta and meta["generation"]
+
+
+def contains_timestamps(log: RunningLog, dts: np.ndarray) -> np.ndarray:
+    idx = np.searchsorted(log.dt, dts)
+    found = idx < len(log.dt)
+    found[found] = log.dt[idx[found]] == dts[found]
+    return found
+
+
+def append_running_lines(csv_path: str, lines: Iterable[str]) -> RunningLog:
+    with open(csv_path, "a+b") as f:
+        if f.tell():
+            f.seek(f.tell() - 1)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        for line in lines:
+            f.write(f"{line}\n".encode())
+    return load_running_log(csv_path)
+
+
+def merge_running_lines(csv_path: str, lines: list[str]) -> RunningLog:
+    """
+    Merge lines which are older than the latest stored run into place,
+    the csv is rewritten through a temp file and the cache is patched
+    """
+    log = load_running_log(csv_path)
+    new = parse_running_csv("".join(f"{line}\n" for line in lines).encode())
+    _merge_sorted(csv_path, sorted(lines, key=lambda line: line.split(",", 1)[0]))
+    positions = np.searchsorted(log.dt, new.dt, side="right")
+    merged = RunningLog(*(np.insert(old, positions, col) for old, col in zip(log, new)))
+    cache_dir = get_cache_dir(csv_path)
+    _append_columns(cache_dir, 0, merged)
+    with open(csv_path, "rb") as f:
+        _write_meta(cache_dir, f, len(merged.dt))
+    return merged
+
+
+def merge_sorted_running_lines(csv_path: str, lines: Iterable[str]) -> RunningLog:
+    """
+    Merge any number of lines already sorted by time without holding them in
+    memory, the cache is rebuilt from the merged csv
+    """
+    _merge_sorted(csv_path, lines)
+    invalidate_cache(csv_path)
+    return load_running_log(csv_path)
+
+
+def invalidate_cache(csv_path: str) -> None:
+    """
+    Make the next load parse the whole csv again, for a csv rewritten in place
+    """
+    try:
+        os.remove(os.path.join(get_cache_dir(csv_path), "meta.json"))
+    except FileNotFoundError:
+        pass
+
+
+def _merge_sorted(csv_path: str, lines: Iterable[str]) -> None:
+    incoming = ((line.split(",", 1)[0], line) for line in lines)
+    tmp = f"{csv_path}.tmp"
+    with open(csv_path) as source, open(tmp, "w") as target:
+        existing = (line.rstrip("\r\n") for line in source if line.strip())
+        first = next(existing, None)
+        if first is not None and first.split(",", 1)[0] == "DT":
+            target.write(f"{first}\n")
+        elif first is not None:
+            existing = itertools.chain([first], existing)
+        existing = ((line.split(",", 1)[0], line) for line in existing)
+        for _, line in heapq.merge(existing, incoming, key=lambda t: t[0]):
+            target.write(f"{line}\n")
+    os.replace(tmp, csv_path)
+
+
+def _tail_hash(f, end: int) -> str:
+    start = max(0, end - TAIL_BYTES)
+    f.seek(start)
+    return hashlib.sha1(f.read(end - start)).hexdigest()
+
+
+def _read_meta(cache_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("version") == CACHE_VERSION else None
+
+
+def _write_meta(cache_dir: str, f, rows: int, generation: Optional[str] = None) -> None:
+    stat = os.fstat(f.fileno())
+    tail = _tail_hash(f, stat.st_size)
+    f.seek(max(0, stat.st_size - 1))
+    meta = {
+        "version": CACHE_VERSION,
+        "inode": stat.st_ino,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "tail": tail,
+        "newline": stat.st_size == 0 or f.read(1) == b"\n",
+        "rows": rows,
+        # 只追加行时沿用，列被重写时换一个，派生的缓存据此判断能否增量更新
+        "generation": generation or uuid.uuid4().hex,
+    }
+    tmp = os.path.join(cache_dir, f"meta.json.{os.getpid()}.tmp")
+    with open(tmp, "w") as out:
+        json.dump(meta, out)
+    os.replace(tmp, os.path.join(cache_dir, "meta.json"))
+
+
+def _open_columns(cache_dir: str, rows: int) -> Optional[RunningLog]:
+    columns = []
+    for name, dtype in COLUMNS.items():
+        path = os.path.join(cache_dir, f"{name}.bin")
+        try:
+            if os.path.getsize(path) != rows * dtype.itemsize:
+                return None
+        except OSError:
+            return None
+        if rows:
+            columns.append(np.memmap(path, dtype=dtype, mode="r", shape=(rows,)))
+        else:
+            columns.append(np.empty(0, dtype=dtype))
+    return RunningLog(*columns)
+
+
+def _append_columns(cache_dir: str, rows: int, log: RunningLog) -> None:
+    for (name, dtype), column in zip(COLUMNS.items(), log):
+        path = os.path.join(cache_dir, f"{name}.bin")
+        data = np.ascontiguousarray(column, dtype=dtype).tobytes()
+        if rows:
+            with open(path, "r+b") as f:
+                f.seek(rows * dtype.itemsize)
+                f.write(data)
+                f.truncate()
+        else:
+            # 整列重写时先写临时文件再替换，已经映射的旧文件不受影响
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+
+def _field_ends(commas: np.ndarray, idx: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    comma = commas[np.minimum(idx, len(commas) - 1)] if len(commas) else ends
+    return np.where((idx < len(commas)) & (comma < ends), comma, ends)
+
+
+def _gather(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """
+    The first MAX_FIELD_BYTES bytes of every field as a matrix, whether each byte
+    is inside the field and whether the whole field fits
+    """
+    width = int(np.minimum(ends - starts, MAX_FIELD_BYTES).max(initial=0))
+    idx = starts[:, None] + np.arange(width)
+    inside = idx < ends[:, None]
+    chars = np.where(inside, buf[np.minimum(idx, max(len(buf) - 1, 0))], 0)
+    return chars, inside, ends - starts <= MAX_FIELD_BYTES
+
+
+def _parse_decimals(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """
+    Parse fields made of ascii digits and at most one dot,
+    return the digits as an integer, whether the field is well-formed and
+    how many digits follow the dot
+    """
+    chars, inside, fits = _gather(buf, starts, ends)
+    digit = (chars >= ord("0")) & (chars <= ord("9"))
+    dot = chars == ord(".")
+    value = np.zeros(len(starts), dtype=np.int64)
+    for j in range(chars.shape[1]):
+        value = np.where(digit[:, j], value * 10 + (chars[:, j] - ord("0")), value)
+    digits = digit.sum(axis=1)
+    ok = ((digit | dot) == inside).all(axis=1) & (digits > 0) & (digits <= 15)
+    ok &= fits
+    frac = (digit & (np.cumsum(dot, axis=1) > 0)).sum(axis=1)
+    return value, ok & ~dot.any(axis=1), np.where(ok, frac, -1)
+
+
+def _parse_datetimes(
+    data: bytes, buf: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    ok = ends - starts == 19
+    base = np.where(ok, starts, 0)[:, None]
+    digits = buf[np.minimum(base + _DT_DIGITS, len(buf) - 1)].astype(np.int64) - 48
+    seps = buf[np.minimum(base + _DT_SEPARATORS, len(buf) - 1)]
+    ok &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+    ok &= (seps == _DT_SEPARATOR_CHARS).all(axis=1)
+    pairs = digits[:, 0::2] * 10 + digits[:, 1::2]
+    year = pairs[:, 0] * 100 + pairs[:, 1]
+    month, day, hour, minute, second = pairs[:, 2:].T
+    ok &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+    ok &= (hour < 24) & (minute < 60) & (second < 60)
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype("M8[M]")
+    days = months.astype("M8[D]") + np.where(ok, day - 1, 0)
+    ok &= days.astype("M8[M]") == months
+    dt = days.astype("M8[s]") + (hour * 3600 + minute * 60 + second)
+    # 不是标准格式的行交给strptime，保证和逐行解析的行为一致
+    for i in np.flatnonzero(~ok):
+        text = data[starts[i] : ends[i]].decode()
+        dt[i] = datetime.strptime(text, "%Y-%m-%d %H:%M:%S")
+    return dt
+
+
+def _parse_floats(
+    data: bytes, buf: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    value, _, frac = _parse_decimals(buf, starts, ends)
+    # 整数除以10的幂是精确舍入的，结果与float()一致
+    result = value / 10.0 ** np.maximum(frac, 0)
+    for i in np.flatnonzero(frac < 0):
+        result[i] = float(data[starts[i] : ends[i]])
+    return result
+
+
+def _parse_paces(
+    data: bytes, buf: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    chars, _, fits = _gather(buf, starts, ends)
+    colon = chars == ord(":")
+    ok = fits & (colon.sum(axis=1) == 1)
+    mid = np.where(ok, colon.argmax(axis=1), 0) + starts
+    mins, mins_ok, _ = _parse_decimals(buf, starts, mid)
+    secs, secs_ok, _ = _parse_decimals(buf, mid + 1, ends)
+    ok &= mins_ok & secs_ok
+    # garmin数据中配速为整分整秒时，比如6:00，传过来的原始值竟然是5:60，
+    # 这里按秒数累加，5:60自然就是6:00
+    pace = mins * 60 + secs
+    for i in np.flatnonzero(~ok):
+        mins_str, secs_str = data[starts[i] : ends[i]].decode().split(":")
+        pace[i] = int(mins_str) * 60 + int(secs_str)
+    return pace
@@ -6,14 +6,25 @@ Copy most code from https://github.com/yihong0618/running_page
 
 import argparse
 import asyncio
+import base64
+import calendar
+import collections
+import heapq
+import json
 import logging
 import os
 import sys
-from datetime import datetime, date, timedelta
+import tempfile
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Optional
 
 import cloudscraper
 import garth
 import httpx
+import tenacity
 
 GITHUB_WORKFLOW_ID = "65380959"
 
@@ -37,7 +48,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 上次成功通知github的最后一条活动：开始时间,活动id
+CURSOR_FILE = os.getenv("GARMIN_CURSOR_FILE", os.path.join(BASE_PATH, "latest"))
+# 没有游标时只同步最近这么多天
+FIRST_SYNC_DAYS = 30
+# github限制一次workflow_dispatch的inputs最多65535个字符，超过了就分批
+MAX_BATCH_CHARS = 60000
+# 一个workflow在并发组里最多一个运行一个排队，再多排队的会被取消，剩下的下次再同步
+MAX_DISPATCHES = 2
+# backfill时每块排好序写一个临时文件，最后归并成从旧到新
+BACKFILL_CHUNK_ROWS = 100_000
+
+# 保存garth会话的地方，下次运行直接复用或刷新token，不用每次都登录
+SESSION_FILE = os.getenv(
+    "GARMIN_SESSION_FILE", os.path.join(BASE_PATH, ".garmin_session.json")
+)
+
 TIME_OUT = httpx.Timeout(240.0, connect=360.0)
+# 客户端限流：平均每秒请求数和允许的突发请求数，被429后速率减半，成功后慢慢恢复
+REQUEST_RATE = 4.0
+REQUEST_BURST = 4
+MIN_REQUEST_RATE = 0.2
+MAX_ATTEMPTS = 6
+MAX_BACKOFF_SECONDS = 120
 GARMIN_COM_URL_DICT = {
     "BASE_URL": "https://connectapi.garmin.com",
     "SSO_URL_ORIGIN": "https://sso.garmin.com",
@@ -62,17 +95,12 @@ GARMIN_CN_URL_DICT = {
 }
 
 
-def notice_github(dts: str, distances: str, hearts: str, paces: str) -> bool:
-    logger.debug(f"send notice github {dts} {distances} {hearts} {paces}")
+def notice_github(batch: str) -> bool:
+    logger.debug(f"send notice github {batch}")
     r = httpx.post(
         GITHUB_WORKFLOW_URL,
         json={
-            "inputs": {
-                "dt": dts,
-                "distance": distances,
-                "heart": hearts,
-                "pace": paces,
-            },
+            "inputs": {"batch": batch},
             "ref": "master",
         },
         headers={"Authorization": ("token %s" % GITHUB_TOKEN)},
@@ -81,13 +109,224 @@ def notice_github(dts: str, distances: str, hearts: str, paces: str) -> bool:
     return r.status_code == 204
 
 
+def encode_batch(rows: list[tuple[str, str, str, str]], final: bool) -> str:
+    """
+    Encode rows for `main.py http --batch`, see main.decode_batch for the format
+    """
+    seconds = [
+        calendar.timegm(datetime.strptime(dt, "%Y-%m-%d %H:%M:%S").timetuple())
+        for dt, _, _, _ in rows
+    ]
+    deltas = [b - a for a, b in zip([0] + seconds, seconds)]
+    distances = [round(float(distance) * 100) for _, distance, _, _ in rows]
+    hearts = [int(heart or 0) for _, _, heart, _ in rows]
+    paces = [
+        int(minutes) * 100 + int(secs)
+        for minutes, secs in (pace.split(":") for _, _, _, pace in rows)
+    ]
+    text = "\n".join(
+        ",".join(map(str, column)) for column in (deltas, distances, hearts, paces)
+    )
+    data = base64.urlsafe_b64encode(zlib.compress(text.encode(), 9)).decode()
+    return f"1.{final:d}.{data}"
+
+
+def to_running_row(run: dict) -> Optional[tuple[str, str, str, str]]:
+    """
+    Convert a garmin activity to a running.csv row, None if it can not be used
+    """
+    distance = run["distance"] / 1000
+    heart = run["averageHR"]
+    duration = run["duration"]
+    if distance <= 0 or not heart or not duration:
+        return None
+    pace_in_seconds = duration / distance
+    return (
+        run["startTimeLocal"],
+        f"{distance:.2f}",
+        f"{heart:.0f}",
+        f"{pace_in_seconds // 60:.0f}:{pace_in_seconds % 60:02.0f}",
+    )
+
+
+def get_retry_after(response: httpx.Response) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header, which is either seconds or a date
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    """
+    Throttle shared by all requests of a client, the rate halves on every rate
+    limit response and grows back a little after each successful request
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = MIN_REQUEST_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.slowed = self.updated
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+            return self.updated
+
+    def slow_down(self, sent: float) -> None:
+        # 同一批并发请求一起被429时只减速一次
+        if sent < self.slowed:
+            return
+        self._refill()
+        self.slowed = self.updated
+        self.rate = max(self.min_rate, self.rate / 2)
+        # 清空令牌，别让攒下的突发请求继续打到服务器上
+        self.tokens = min(self.tokens, 0.0)
+
+    def speed_up(self) -> None:
+        self._refill()
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def wait_retry_after(fallback: tenacity.wait.wait_base):
+    """
+    Wait as long as the server asked in Retry-After, backoff with jitter otherwise
+    """
+
+    def wait(retry_state: tenacity.RetryCallState) -> float:
+        error = retry_state.outcome.exception()
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, MAX_BACKOFF_SECONDS)
+        return fallback(retry_state)
+
+    return wait
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (GarminConnectTooManyRequestsError, httpx.TransportError)):
+        return True
+    return (
+        isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+    )
+
+
+def read_cursor(path: str) -> tuple[Optional[str], int]:
+    """
+    Start time and activity id of the last synced activity, older cursor files
+    only have the start time
+    """
+    try:
+        with open(path) as f:
+            line = f.read().strip()
+    except OSError:
+        return None, 0
+    if not line:
+        return None, 0
+    start_time, _, activity_id = line.partition(",")
+    return start_time, int(activity_id or 0)
+
+
+def write_cursor(path: str, start_time: str, activity_id: int) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{start_time},{activity_id}\n")
+    os.replace(tmp, path)
+
+
+def load_session(path: str) -> dict:
+    try:
+        with open(path) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return session if isinstance(session, dict) else {}
+
+
+def save_session(path: str, session: dict) -> None:
+    # 里面是token，只给自己读写
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(session, f)
+    os.replace(tmp, path)
+
+
+def get_secret_string(email: str, password: str, path: str = SESSION_FILE) -> str:
+    """
+    Reuse the garth session saved by the last run, refresh it when the token
+    expired, and log in with the password only when that fails
+    """
+    start = time.perf_counter()
+    session = load_session(path)
+    how = None
+    if session.get("secret"):
+        try:
+            garth.client.loads(session["secret"])
+            if garth.client.oauth2_token.expired:
+                garth.client.refresh_oauth2()
+                how = "refreshed"
+            else:
+                how = "reused"
+        except Exception as err:
+            logger.warning(f"cached session is not usable, login again: {err}")
+    if how is None:
+        garth.login(email, password)
+        how = "login"
+    seconds = time.perf_counter() - start
+    if how == "login":
+        session["login_seconds"] = seconds
+        logger.info(f"logged in in {seconds:.2f}s")
+    elif session.get("login_seconds"):
+        saved = session["login_seconds"] - seconds
+        logger.info(f"{how} cached session in {seconds:.2f}s, saved {saved:.2f}s")
+    else:
+        logger.info(f"{how} cached session in {seconds:.2f}s")
+    session["secret"] = garth.client.dumps()
+    save_session(path, session)
+    return session["secret"]
+
+
 class Garmin:
-    def __init__(self, secret_string, auth_domain, is_only_running=False):
+    def __init__(
+        self,
+        secret_string,
+        auth_domain,
+        is_only_running=False,
+        base_url=None,
+        rate=REQUEST_RATE,
+        burst=REQUEST_BURST,
+        session_path=None,
+    ):
         """
         Init module
         """
-        self.email = email
-        self.password = password
+        self.email = GARMIN_USERNAME
+        self.password = GARMIN_PASSWORD
         self.req = httpx.AsyncClient(timeout=TIME_OUT)
         self.cf_req = cloudscraper.CloudScraper()
         self.URL_DICT = (
@@ -95,46 +334,88 @@ class Garmin:
             if auth_domain and str(auth_domain).upper() == "CN"
             else GARMIN_COM_URL_DICT
         )
-        self.modern_url = self.URL_DICT.get("MODERN_URL")
-        garth.client.loads(secret_string)
-        if garth.client.oauth2_token.expired:
-            garth.client.refresh_oauth2()
-
+        # base_url可以指向本地的mock服务，此时不需要登录
+        self.modern_url = base_url or self.URL_DICT.get("MODERN_URL")
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.88 Safari/537.36",
             "origin": self.URL_DICT.get("SSO_URL_ORIGIN"),
             "nk": "NT",
-            "Authorization": str(garth.client.oauth2_token),
         }
+        if secret_string:
+            garth.client.loads(secret_string)
+            if garth.client.oauth2_token.expired:
+                garth.client.refresh_oauth2()
+            self.headers["Authorization"] = str(garth.client.oauth2_token)
         self.is_only_running = is_only_running
+        self.bucket = TokenBucket(rate, burst)
+        self.auth_lock = asyncio.Lock()
+        self.session_path = session_path
         self.upload_url = self.URL_DICT.get("UPLOAD_URL")
         self.activity_url = self.URL_DICT.get("ACTIVITY_URL")
 
-    async def fetch_data(self, url, retrying=False):
+    async def fetch_data(self, url):
         """
-        Fetch and return data
+        Fetch and return data, throttled by the token bucket, retried with
+        backoff on rate limiting and server errors, re-authenticated once when
+        the session expired
         """
         try:
-            response = await self.req.get(url, headers=self.headers)
-            if response.status_code == 429:
-                raise GarminConnectTooManyRequestsError("Too many requests")
-            logger.debug(f"fetch_data got response code {response.status_code}")
-            response.raise_for_status()
-            return response.json()
-        except Exception as err:
-            if retrying:
-                logger.debug(
-                    "Exception occurred during data retrieval, relogin without effect: %s"
-                    % err
-                )
-                raise GarminConnectConnectionError("Error connecting") from err
-            else:
-                logger.debug(
-                    "Exception occurred during data retrieval - perhaps session expired - trying relogin: %s"
-                    % err
-                )
-                self.login()
-                await self.fetch_data(url, retrying=True)
+            return await self.fetch_with_retry(url)
+        except GarminConnectAuthenticationError as err:
+            if "Authorization" not in self.headers:
+                raise
+            logger.info(f"session expired, re-authenticating: {err}")
+            await self.refresh_login(err.authorization)
+            return await self.fetch_with_retry(url)
+
+    async def fetch_with_retry(self, url):
+        retrying = tenacity.AsyncRetrying(
+            retry=tenacity.retry_if_exception(is_retryable),
+            wait=wait_retry_after(
+                tenacity.wait_exponential_jitter(initial=1, max=MAX_BACKOFF_SECONDS)
+            ),
+            stop=tenacity.stop_after_attempt(MAX_ATTEMPTS),
+            before_sleep=tenacity.before_sleep_log(logger, logging.WARNING),
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await self.fetch_once(url)
+
+    async def fetch_once(self, url):
+        sent = await self.bucket.acquire()
+        authorization = self.headers.get("Authorization")
+        response = await self.req.get(url, headers=self.headers)
+        logger.debug(f"fetch_data got response code {response.status_code}")
+        if response.status_code == 429:
+            self.bucket.slow_down(sent)
+            raise GarminConnectTooManyRequestsError(
+                "Too many requests", get_retry_after(response)
+            )
+        if response.status_code == 401:
+            raise GarminConnectAuthenticationError("Unauthorized", authorization)
+        response.raise_for_status()
+        self.bucket.speed_up()
+        return response.json()
+
+    async def refresh_login(self, authorization):
+        """
+        Refresh the oauth2 token, log in again if refreshing fails
+        """
+        async with self.auth_lock:
+            # 并发的请求可能已经刷新过了
+            if self.headers.get("Authorization") != authorization:
+                return
+            try:
+                garth.client.refresh_oauth2()
+            except Exception as err:
+                logger.warning(f"refresh token failed, login again: {err}")
+                garth.login(self.email, self.password)
+            self.headers["Authorization"] = str(garth.client.oauth2_token)
+            if self.session_path:
+                session = load_session(self.session_path)
+                session["secret"] = garth.client.dumps()
+                save_session(self.session_path, session)
 
     async def get_activities(self, start, limit, start_date=None):
         """
@@ -148,6 +429,139 @@ class Garmin:
             url = url + "&activityType=running"
         return await self.fetch_data(url)
 
+    async def iter_activities(
+        self, page_size=100, concurrency=4, start_date=None
+    ) -> AsyncIterator[dict]:
+        """
+        Walk the whole activity list, up to `concurrency` pages are fetched at
+        once but activities are yielded in page order as soon as they arrive
+        """
+        semaphore = asyncio.BoundedSemaphore(concurrency)
+
+        async def fetch_page(start):
+            async with semaphore:
+                return await self.get_activities(start, page_size, start_date)
+
+        pending = collections.deque()
+        next_start = 0
+        try:
+            while True:
+                while len(pending) < concurrency:
+                    pending.append(asyncio.ensure_future(fetch_page(next_start)))
+                    next_start += page_size
+                page = await pending.popleft()
+                for activity in page or []:
+                    yield activity
+                if not page or len(page) < page_size:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def spill_rows(spill_dir: str, spills: list[str], lines: list[str]) -> None:
+    spill = os.path.join(spill_dir, f"{len(spills)}.csv")
+    with open(spill, "w") as f:
+        f.writelines(f"{line}\n" for line in sorted(lines))
+    spills.append(spill)
+
+
+async def backfill(client: Garmin, path: str, page_size: int, concurrency: int) -> int:
+    """
+    Write every run to a running.csv at path, oldest first. The activity list
+    comes newest first, so it is put in order through sorted spill files
+    """
+    spill_root = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(dir=spill_root) as spill_dir:
+        spills, lines = [], []
+        async for run in client.iter_activities(page_size, concurrency):
+            row = to_running_row(run)
+            if row:
+                lines.append(",".join(row))
+            if len(lines) >= BACKFILL_CHUNK_ROWS:
+                spill_rows(spill_dir, spills, lines)
+                lines = []
+        if lines:
+            spill_rows(spill_dir, spills, lines)
+        files = [open(spill) for spill in spills]
+        try:
+            count, last = 0, None
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                f.write("DT,distance(Km),heart,pace\n")
+                # 同一开始时间的活动在running.csv里只能有一条
+                for line in heapq.merge(*files, key=lambda line: line.split(",", 1)[0]):
+                    dt = line.split(",", 1)[0]
+                    if dt != last:
+                        last = dt
+                        f.write(line)
+                        count += 1
+            os.replace(tmp, path)
+        finally:
+            for f in files:
+                f.close()
+    return count
+
+
+async def get_new_activities(
+    client: Garmin,
+    cursor: tuple[Optional[str], int],
+    page_size: int,
+    concurrency: int,
+) -> list[dict]:
+    """
+    Activities after the cursor, oldest first
+    """
+    start_time, activity_id = cursor
+    if start_time is None:
+        start_time = (
+            f"{date.today() - timedelta(days=FIRST_SYNC_DAYS):%Y-%m-%d} 00:00:00"
+        )
+    # garmin只能按天过滤，同一天里已经同步过的在这里去掉
+    activities = {}
+    async for run in client.iter_activities(page_size, concurrency, start_time[:10]):
+        if (run["startTimeLocal"], run["activityId"]) > (start_time, activity_id):
+            activities[run["activityId"]] = run
+    return sorted(
+        activities.values(), key=lambda r: (r["startTimeLocal"], r["activityId"])
+    )
+
+
+def split_batches(activities: list[dict]) -> list[list[dict]]:
+    """
+    Split activities in halves until every batch fits in one workflow_dispatch
+    """
+    rows = [row for run in activities if (row := to_running_row(run))]
+    if len(activities) == 1 or len(encode_batch(rows, True)) <= MAX_BATCH_CHARS:
+        return [activities]
+    middle = len(activities) // 2
+    return split_batches(activities[:middle]) + split_batches(activities[middle:])
+
+
+def sync_activities(activities: list[dict], cursor_path: str) -> bool:
+    """
+    Notice github in batches, the cursor only moves past a batch after github
+    accepted it, so a failed run is retried next time. Only the last batch sent
+    is marked final, so the workflow plots once
+    """
+    batches = split_batches(activities)[:MAX_DISPATCHES]
+    batch_rows = [
+        [r for run in batch if (r := to_running_row(run))] for batch in batches
+    ]
+    last = max((i for i, rows in enumerate(batch_rows) if rows), default=-1)
+    for i, (batch, rows) in enumerate(zip(batches, batch_rows)):
+        if rows:
+            logger.info(
+                f"got new data {rows[0][0]} ... {rows[-1][0]}, {len(rows)} runs"
+            )
+            if not notice_github(encode_batch(rows, i == last)):
+                logger.error("notice github fail")
+                return False
+            logger.info("notice github success")
+        # 没有可用数据的活动（比如没心率）也跳过，免得每次都重新下载
+        write_cursor(cursor_path, batch[-1]["startTimeLocal"], batch[-1]["activityId"])
+    return True
+
 
 class GarminConnectConnectionError(Exception):
     """Raised when communication ended in error."""
@@ -161,10 +575,21 @@ class GarminConnectConnectionError(Exception):
 class GarminConnectTooManyRequestsError(Exception):
     """Raised when rate limit is exceeded."""
 
-    def __init__(self, status):
+    def __init__(self, status, retry_after=None):
         """Initialize."""
         super(GarminConnectTooManyRequestsError, self).__init__(status)
         self.status = status
+        self.retry_after = retry_after
+
+
+class GarminConnectAuthenticationError(Exception):
+    """Raised when the session is not authorized any more."""
+
+    def __init__(self, status, authorization=None):
+        """Initialize."""
+        super(GarminConnectAuthenticationError, self).__init__(status)
+        self.status = status
+        self.authorization = authorization
 
 
 if __name__ == "__main__":
@@ -181,18 +606,70 @@ if __name__ == "__main__":
         action="store_true",
         help="if is only for running",
     )
+    parser.add_argument(
+        "--backfill",
+        metavar="FILE",
+        help="write the whole activity history to this csv instead of syncing",
+    )
+    parser.add_argument(
+        "--page-size",
+        dest="page_size",
+        type=int,
+        default=100,
+        help="activities per request",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="pages fetched at once",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=REQUEST_RATE,
+        help="requests per second at most, lowered automatically when throttled",
+    )
+    parser.add_argument(
+        "--burst",
+        type=int,
+        default=REQUEST_BURST,
+        help="requests allowed at once before the rate applies",
+    )
+    parser.add_argument(
+        "--cursor",
+        default=CURSOR_FILE,
+        help="file keeping the last synced activity",
+    )
+    parser.add_argument(
+        "--session",
+        default=SESSION_FILE,
+        help="file to keep the garmin session in between runs",
+    )
+    parser.add_argument(
+        "--base-url",
+        dest="base_url",
+        help="garmin connect api url, e.g. a local mock server, skips login",
+    )
     options = parser.parse_args()
     email = GARMIN_USERNAME
     password = GARMIN_PASSWORD
     auth_domain = "CN" if options.is_cn else None
     is_only_running = options.only_run
-    if options.is_cn:
-        garth.configure(domain="garmin.cn")
-    garth.login(email, password)
-    secret_string = garth.client.dumps()
-    client = Garmin(secret_string, auth_domain, is_only_running)
-    today = date.today()
-    month_ago = today - timedelta(days=30)
+    secret_string = None
+    if not options.base_url:
+        if options.is_cn:
+            garth.configure(domain="garmin.cn")
+        secret_string = get_secret_string(email, password, options.session)
+    client = Garmin(
+        secret_string,
+        auth_domain,
+        is_only_running,
+        options.base_url,
+        options.rate,
+        options.burst,
+        session_path=None if options.base_url else options.session,
+    )
     if sys.version_info < (3, 10):
         loop = asyncio.get_event_loop()
     else:
@@ -201,44 +678,19 @@ if __name__ == "__main__":
         except RuntimeError:
             loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-    runs = loop.run_until_complete(
-        client.get_activities(0, 60, start_date=f"{month_ago:%Y-%m-%d}")
-    )
-    if runs:
-        new_data = [
-            (
-                dt_str,
-                dt,
-                distance,
-                heart,
-                f"{(pace_in_seconds := duration / distance) // 60:.0f}:{pace_in_seconds % 60:02.0f}",
-            )
-            for run in runs
-            if (
-                dt := datetime.strptime(
-                    dt_str := run["startTimeLocal"], "%Y-%m-%d %H:%M:%S"
-                )
-            )
-            > datetime(year=month_ago.year, month=month_ago.month, day=month_ago.day)
-            and (distance := run["distance"] / 1000) > 0
-            and (heart := run["averageHR"])
-            and (duration := run["duration"])
-        ]
-        new_data.sort(key=lambda t: t[1])
-        if new_data:
-            dts = [dt_str for dt_str, _, _, _, _ in new_data]
-            distances = [f"{distance:.2f}" for _, _, distance, _, _ in new_data]
-            hearts = [f"{heart:.0f}" for _, _, _, heart, _ in new_data]
-            paces = [pace for _, _, _, _, pace in new_data]
-            logger.info(f"got new data {dts} {distances} {hearts} {paces}")
-            if notice_github(
-                ",".join(dts), ",".join(distances), ",".join(hearts), ",".join(paces)
-            ):
-                logger.info("notice github success")
-            else:
-                logger.error("notice github fail")
-        else:
-            logger.info("no new data")
-
+    if options.backfill:
+        count = loop.run_until_complete(
+            backfill(client, options.backfill, options.page_size, options.concurrency)
+        )
+        logger.info(f"backfilled {count} runs to {options.backfill}")
+        sys.exit(0)
+    cursor = read_cursor(options.cursor)
+    logger.info(f"sync activities after {cursor}")
+    activities = loop.run_until_complete(
+        get_new_activities(client, cursor, options.page_size, options.concurrency)
+    )
+    if activities:
+        if not sync_activities(activities, options.cursor):
+            sys.exit(1)
     else:
-        logger.info("no data")
+        logger.info("no new data")
@@ -3,12 +3,16 @@ Fetch running_page activities.json to get your statistics.
 For more running_page information, please visit https://github.com/yihong0618/running_page
 """
 
+import argparse
+import gzip
+import io
 import logging
 import json
 import math
 import os
+import urllib.error
 import urllib.request
-import sys
+from typing import Iterable, Iterator, Optional
 
 logger = logging.getLogger(__name__)
 BASE_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -21,37 +25,221 @@ logging.basicConfig(
     ],
 )
 logger = logging.getLogger(__name__)
+# 可以指向本地的http服务来测试
+BASE_URL = os.getenv("RUNNING_PAGE_BASE_URL", "https://raw.githubusercontent.com")
+# 缓存上次下载的activities.json和它的ETag/Last-Modified，没变化时只发一个很小的请求
+CACHE_DIR = os.path.join(BASE_PATH, ".running_page.cache")
 
 def get_activities_download_path(running_page_repo: str) -> str:
-  return "https://raw.githubusercontent.com/{repo}/master/src/static/activities.json".format(repo=running_page_repo)
+  return "{base}/{repo}/master/src/static/activities.json".format(base=BASE_URL, repo=running_page_repo)
 
-def get_activities(running_page_repo: str) -> []:
+# 只留下写running.csv用到的字段
+FIELDS = ("start_date_local", "distance", "average_heartrate", "average_speed")
+CHUNK_SIZE = 64 * 1024
+
+class TeeReader(io.RawIOBase):
+  """
+  Read from the response and copy every byte to the cache file on the way
+  """
+  def __init__(self, source, sink):
+    self.source = source
+    self.sink = sink
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, b) -> int:
+    data = self.source.read(len(b))
+    self.sink.write(data)
+    b[:len(data)] = data
+    return len(data)
+
+def iter_json_array(stream, fields=FIELDS) -> Iterator[dict]:
+  """
+  Yield the objects of a json array one at a time from a text stream, so only one
+  chunk and one object are in memory however long the array is
+  """
+  decoder = json.JSONDecoder()
+  buf, pos, eof = "", 0, False
+  expect = "["
+  while True:
+    while pos < len(buf) and buf[pos] in " \t\r\n":
+      pos += 1
+    if pos == len(buf):
+      if eof:
+        raise ValueError("activities.json ended in the middle of the array")
+      buf, pos = stream.read(CHUNK_SIZE), 0
+      eof = not buf
+      continue
+    char = buf[pos]
+    if expect == "[":
+      if char != "[":
+        raise TypeError("activities.json is invalid, expect list type")
+      pos += 1
+      expect = "first"
+    elif char == "]" and expect in ("first", ","):
+      return
+    elif expect == ",":
+      if char != ",":
+        raise ValueError("activities.json is invalid at {char!r}".format(char=char))
+      pos += 1
+      expect = "value"
+    else:
+      try:
+        obj, end = decoder.raw_decode(buf, pos)
+      except json.JSONDecodeError:
+        # 对象被块边界截断了，再读一块接着解析
+        if eof:
+          raise
+        chunk = stream.read(CHUNK_SIZE)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+        continue
+      if not isinstance(obj, dict):
+        raise TypeError("activities.json is invalid, expect list of objects")
+      yield {field: obj.get(field) for field in fields}
+      pos = end
+      expect = ","
+
+def read_meta(path: str) -> dict:
+  try:
+    with open(os.path.join(CACHE_DIR, "meta.json")) as f:
+      meta = json.load(f)
+  except (OSError, ValueError):
+    return {}
+  if meta.get("url") != path or not os.path.exists(os.path.join(CACHE_DIR, "activities.json.body")):
+    return {}
+  return meta
+
+def stream_activities(path: str, response) -> Iterator[dict]:
+  """
+  Parse activities while the response is downloaded, the raw response is kept in
+  the cache only after it has been read completely
+  """
+  headers = response.headers
+  encoding = headers.get("Content-Encoding")
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  tmp = os.path.join(CACHE_DIR, "activities.json.body.tmp")
+  with response, open(tmp, "wb") as cache:
+    raw = TeeReader(response, cache)
+    binary = gzip.GzipFile(fileobj=raw) if encoding == "gzip" else io.BufferedReader(raw)
+    text = io.TextIOWrapper(binary, encoding="utf-8")
+    yield from iter_json_array(text)
+    while text.read(CHUNK_SIZE):
+      pass
+    size = cache.tell()
+  logger.info("downloaded {size} bytes".format(size=size))
+  os.replace(tmp, os.path.join(CACHE_DIR, "activities.json.body"))
+  meta = {
+    "url": path,
+    "encoding": encoding,
+    "etag": headers.get("ETag"),
+    "last_modified": headers.get("Last-Modified"),
+  }
+  with open(os.path.join(CACHE_DIR, "meta.json.tmp"), "w") as f:
+    json.dump(meta, f)
+  os.replace(os.path.join(CACHE_DIR, "meta.json.tmp"), os.path.join(CACHE_DIR, "meta.json"))
+
+def read_cached_activities(meta: dict) -> Iterator[dict]:
+  """
+  Replay the activities.json kept by the last download, in the encoding it was sent with
+  """
+  with open(os.path.join(CACHE_DIR, "activities.json.body"), "rb") as raw:
+    binary = gzip.GzipFile(fileobj=raw) if meta.get("encoding") == "gzip" else raw
+    text = io.TextIOWrapper(binary, encoding="utf-8")
+    yield from iter_json_array(text)
+
+def get_activities(running_page_repo: str, replay: bool = False) -> Optional[Iterator[dict]]:
+  """
+  Stream activities from activities.json with gzip. When it is the same as the cached
+  copy, return None, or with replay the activities of the cached copy
+  """
   logger.info("getting activities from running_repo [{repo}]...".format(repo=running_page_repo))
   path = get_activities_download_path(running_page_repo)
+  meta = read_meta(path)
+  request = urllib.request.Request(path, headers={"Accept-Encoding": "gzip"})
+  if meta.get("etag"):
+    request.add_header("If-None-Match", meta["etag"])
+  if meta.get("last_modified"):
+    request.add_header("If-Modified-Since", meta["last_modified"])
   try:
-    with urllib.request.urlopen(path) as url:
-      activities = json.loads(url.read().decode())
-  except:
+    response = urllib.request.urlopen(request)
+  except Exception as e:
+    if isinstance(e, urllib.error.HTTPError) and e.code == 304:
+      if replay:
+        logger.info("activities.json not modified, reading the cached copy")
+        return read_cached_activities(meta)
+      logger.info("activities.json not modified")
+      return None
     logger.error("[Error] failed to get activities from running_repo [{repo}]({path})".format(repo=running_page_repo, path=path))
     raise
-  if isinstance(activities, list):
-    logger.info("got {number} activities records".format(number=len(activities)))
-    return activities
-  else:
-      raise TypeError("activities.json is invalid, expect list type")
+  return stream_activities(path, response)
+
+HEADER = "DT,distance(Km),heart,pace\n"
 
-def refresh_running_csv(activities: list):
+def format_row(activity: dict) -> str:
+  return "{date},{distance:.2f},{heart},{pace}\n".format(
+    date=activity["start_date_local"],
+    distance=activity["distance"]/1000.,
+    heart='{:.0f}'.format(activity["average_heartrate"]) if activity["average_heartrate"] else '',
+    pace=get_format_pace(activity["average_speed"]),
+  )
+
+def replace_running_csv():
+  os.replace("running.csv.tmp", "running.csv")
+  # 和main.py的store.invalidate_cache一样，重写过的文件不能当成只追加了行
+  try:
+    os.remove(os.path.join(".running.csv.cache", "meta.json"))
+  except FileNotFoundError:
+    pass
+
+def refresh_running_csv(activities: Iterable[dict]):
   logger.info("writing records to running.csv...")
-  with open("running.csv", "w") as f:
-    f.write("DT,distance(Km),heart,pace\n")
+  # 边下载边写，先写到临时文件，下载失败了不会留下半个running.csv
+  count = 0
+  with open("running.csv.tmp", "w") as f:
+    f.write(HEADER)
     for activity in activities:
-      f.write("{date},{distance:.2f},{heart},{pace}\n".format(
-        date=activity["start_date_local"],
-        distance=activity["distance"]/1000.,
-        heart='{:.0f}'.format(activity["average_heartrate"]) if activity["average_heartrate"] else '',
-        pace=get_format_pace(activity["average_speed"]),
-      ))
+      f.write(format_row(activity))
+      count += 1
+  replace_running_csv()
+  logger.info("got {number} activities records".format(number=count))
+  logger.info("done")
+
+def merge_running_csv(activities: Iterable[dict]) -> tuple[int, int, int]:
+  """
+  Merge activities into the existing running.csv by timestamp instead of rewriting it,
+  rows that are not in activities.json are kept. Return added, updated and skipped counts
+  """
+  logger.info("merging records into running.csv...")
+  rows = {}
+  if os.path.exists("running.csv"):
+    with open("running.csv") as f:
+      for line in f:
+        dt = line.split(",", 1)[0]
+        if line.strip() and dt != "DT":
+          rows[dt] = line if line.endswith("\n") else line + "\n"
+  added = updated = skipped = 0
+  for activity in activities:
+    line = format_row(activity)
+    old = rows.get(activity["start_date_local"])
+    if old == line:
+      skipped += 1
+      continue
+    if old is None:
+      added += 1
+    else:
+      updated += 1
+    rows[activity["start_date_local"]] = line
+  logger.info("added {added}, updated {updated}, skipped {skipped} records".format(added=added, updated=updated, skipped=skipped))
+  # 没有变化就不动文件，git里也不会有diff
+  if added or updated:
+    with open("running.csv.tmp", "w") as f:
+      f.write(HEADER)
+      f.writelines(rows[dt] for dt in sorted(rows))
+    replace_running_csv()
   logger.info("done")
+  return added, updated, skipped
 
 def get_format_pace(average_speed: float) -> str:
   pace = (1000.0 / 60.0) * (1.0 / average_speed)
@@ -60,10 +248,20 @@ def get_format_pace(average_speed: float) -> str:
   return "{}:{:02d}".format(minutes, seconds)
 
 if __name__ == "__main__":
-    args = sys.argv
-    if len(args) != 2:
-        sys.exit("args is not right, e.g. python running_page.py yihong0618/running_page")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("running_page_repo", help="your running_page repo, e.g. yihong0618/running_page")
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="merge new and changed activities into running.csv instead of rewriting it",
+    )
+    options = parser.parse_args()
 
-    running_page_repo = args[1]
-    activities = get_activities(running_page_repo)
-    refresh_running_csv(activities)
+    # running.csv不在了就得用完整的activities.json重建，没变化时用缓存的那份
+    activities = get_activities(options.running_page_repo, replay=not os.path.exists("running.csv"))
+    if activities is None:
+      logger.info("running.csv is up to date")
+    elif options.merge:
+      merge_running_csv(activities)
+    else:
+      refresh_running_csv(activities)
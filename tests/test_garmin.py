@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import random
+from datetime import datetime, timedelta
+
+import main
+from syncer import garmin
+
+
+def make_activity(rng: random.Random, i: int, start: datetime) -> dict:
+    return {
+        "activityId": i,
+        "startTimeLocal": f"{start:%Y-%m-%d %H:%M:%S}",
+        "distance": rng.uniform(1000, 42195),
+        "averageHR": rng.randint(100, 190),
+        "duration": rng.uniform(1200, 15000),
+    }
+
+
+def test_batch_round_trip():
+    rows = [
+        ("2019-03-29 21:49:01", "3.25", "148", "6:31"),
+        # 比上一条早，差值是负数
+        ("2019-03-28 06:00:00", "10.00", "", "5:60"),
+        ("2019-03-31 07:00:00", "0.05", "150", "12:05"),
+    ]
+    batch = garmin.encode_batch(rows, True)
+    dts, distances, hearts, paces, final = main.decode_batch(batch)
+    assert dts.split(",") == [row[0] for row in rows]
+    assert distances.split(",") == [row[1] for row in rows]
+    assert hearts.split(",") == [row[2] for row in rows]
+    assert paces.split(",") == [row[3] for row in rows]
+    assert final
+    assert not main.decode_batch(garmin.encode_batch(rows, False))[4]
+
+
+def test_batches_fit_and_only_the_last_sent_is_final(tmp_path, monkeypatch):
+    monkeypatch.setattr(garmin, "MAX_BATCH_CHARS", 1000)
+    rng = random.Random(0)
+    start = datetime(2019, 1, 1)
+    activities = [make_activity(rng, i, start + timedelta(hours=i)) for i in range(500)]
+    batches = garmin.split_batches(activities)
+    assert len(batches) > garmin.MAX_DISPATCHES
+    assert [run for batch in batches for run in batch] == activities
+    for batch in batches:
+        rows = [row for run in batch if (row := garmin.to_running_row(run))]
+        assert len(garmin.encode_batch(rows, True)) <= garmin.MAX_BATCH_CHARS
+
+    sent = []
+    monkeypatch.setattr(garmin, "notice_github", lambda batch: not sent.append(batch))
+    assert garmin.sync_activities(activities, str(tmp_path / "latest"))
+    assert len(sent) == garmin.MAX_DISPATCHES
+    finals = [main.decode_batch(batch)[4] for batch in sent]
+    assert finals == [False] * (len(sent) - 1) + [True]
+    # 游标停在最后一个发出去的批次
+    last = batches[garmin.MAX_DISPATCHES - 1][-1]
+    assert (tmp_path / "latest").read_text() == (
+        f"{last['startTimeLocal']},{last['activityId']}\n"
+    )
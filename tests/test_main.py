@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import main
+from bench.generate import generate_running_csv
+from bench.run import MAX_ERROR_PX, PLOT_HEIGHT_PX
+from records import load_records, update_records
+from rollup import build_rollup, load_rollup
+from store import (
+    get_distances,
+    get_generation,
+    load_running_log,
+    parse_running_csv,
+)
+
+HEADER = "DT,distance(Km),heart,pace"
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "running.csv")
+
+
+def get_training_load_by_day(csv_path: str):
+    """
+    Weekly, acute, chronic and ratio of every day, summing the window day by day
+    """
+    dts, _, distances, _, _ = main.get_running_data(csv_path)
+    totals = {}
+    for dt, distance in zip(dts, distances):
+        totals[dt.date()] = totals.get(dt.date(), 0.0) + distance
+    day, last = min(totals), max(totals)
+    rows = []
+    while day <= last:
+        acute = sum(
+            totals.get(day - timedelta(days=i), 0.0) for i in range(main.ACUTE_DAYS)
+        )
+        chronic = sum(
+            totals.get(day - timedelta(days=i), 0.0) for i in range(main.CHRONIC_DAYS)
+        )
+        acute, chronic = acute / main.ACUTE_DAYS, chronic / main.CHRONIC_DAYS
+        ratio = acute / chronic if chronic else float("nan")
+        rows.append((day, acute * main.ACUTE_DAYS, acute, chronic, ratio))
+        day += timedelta(days=1)
+    return rows
+
+
+def check_training_load(csv_path: str) -> None:
+    load = main.get_training_load(load_rollup(csv_path).day)
+    expected = get_training_load_by_day(csv_path)
+    assert [day.item() for day in load.days] == [row[0] for row in expected]
+    for i, column in enumerate(("weekly", "acute", "chronic", "ratio"), 1):
+        assert getattr(load, column) == pytest.approx(
+            [row[i] for row in expected], rel=1e-12, abs=1e-12, nan_ok=True
+        ), column
+
+
+def test_training_load_of_sample_log(tmp_path):
+    csv_path = str(tmp_path / "running.csv")
+    shutil.copyfile(SAMPLE, csv_path)
+    check_training_load(csv_path)
+
+
+def test_training_load_with_gaps_and_short_log(tmp_path):
+    # 不到28天，同一天跑两次，中间有超过一周没跑
+    start = date(2024, 2, 25)
+    runs = [(0, "5.00"), (0, "3.25"), (1, "10.005"), (3, "7.10"), (15, "4.00")]
+    csv_path = tmp_path / "running.csv"
+    csv_path.write_text(
+        "\n".join(
+            [HEADER]
+            + [
+                f"{start + timedelta(days=day)} 07:0{i}:00,{distance},150,5:00"
+                for i, (day, distance) in enumerate(runs)
+            ]
+        )
+        + "\n"
+    )
+    check_training_load(str(csv_path))
+    load = main.get_training_load(load_rollup(str(csv_path)).day)
+    assert len(load.days) == 16
+    # 最后一次之前连续一周多没跑，急性负荷只剩当天的
+    assert load.weekly[-1] == pytest.approx(4.0)
+
+
+def test_training_load_of_one_day(tmp_path):
+    csv_path = tmp_path / "running.csv"
+    csv_path.write_text(f"{HEADER}\n2024-01-01 07:00:00,5.00,150,5:00\n")
+    load = main.get_training_load(load_rollup(str(csv_path)).day)
+    assert load.weekly.tolist() == [5.0]
+    assert load.ratio.tolist() == [pytest.approx(4.0)]
+
+
+def get_distance_line(csv_path: str) -> tuple[np.ndarray, np.ndarray]:
+    log = load_running_log(csv_path)
+    x = log.dt.astype(np.int64).astype(np.float64)
+    return x, np.cumsum(get_distances(log))
+
+
+@pytest.mark.parametrize("rows", [10_000, 100_000])
+def test_downsample_keeps_the_line_within_a_pixel(tmp_path, rows):
+    csv_path = str(tmp_path / "running.csv")
+    generate_running_csv(csv_path, rows, 0)
+    x, y = get_distance_line(csv_path)
+    kept = main.downsample_lttb(x, y, main.POINT_BUDGET)
+    assert len(kept) == main.POINT_BUDGET
+    assert kept[0] == 0 and kept[-1] == len(x) - 1
+    assert np.all(np.diff(kept) > 0)
+    assert main.get_downsample_error(x, y, kept) * PLOT_HEIGHT_PX < MAX_ERROR_PX
+
+
+@pytest.mark.parametrize("rows", [1, 2, main.POINT_BUDGET])
+def test_downsample_keeps_short_lines(tmp_path, rows):
+    csv_path = str(tmp_path / "running.csv")
+    generate_running_csv(csv_path, rows, 0)
+    x, y = get_distance_line(csv_path)
+    kept = main.downsample_lttb(x, y, main.POINT_BUDGET)
+    assert kept.tolist() == list(range(len(x)))
+    assert main.get_downsample_error(x, y, kept) == 0.0
+
+
+SYNC_LINES = [
+    HEADER,
+    "2019-03-28 21:49:01,3.25,148,6:31",
+    "2019-03-30 21:16:43,10.50,150,6:22",
+    "2019-04-02 07:00:00,5.00,,5:60",
+]
+
+
+@pytest.fixture
+def sync_csv(tmp_path, monkeypatch):
+    # sync_data写的是当前目录下的running.csv
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "running.csv").write_text("\n".join(SYNC_LINES) + "\n")
+    return tmp_path / "running.csv"
+
+
+def test_sync_merges_a_late_run_into_place(sync_csv):
+    generation = get_generation("running.csv")
+    load_rollup("running.csv")
+    load_records("running.csv")
+    assert main.sync_data(
+        "2019-03-29 06:00:00,2019-04-03 06:00:00", "21.10,4.00", "160,", "5:10,6:00"
+    )
+    assert sync_csv.read_text().splitlines() == [
+        *SYNC_LINES[:2],
+        "2019-03-29 06:00:00,21.10,160,5:10",
+        *SYNC_LINES[2:],
+        "2019-04-03 06:00:00,4.00,,6:00",
+    ]
+    # np.insert补上的缓存和冷启动重新解析的一样
+    cold = parse_running_csv(sync_csv.read_bytes())
+    log = load_running_log("running.csv")
+    for column, expected in zip(log, cold):
+        assert column.tolist() == expected.tolist()
+    # 插入到中间换了generation，rollup和records要整个重建
+    assert get_generation("running.csv") != generation
+    for table, expected in zip(load_rollup("running.csv"), build_rollup(cold)):
+        assert table.tolist() == expected.tolist()
+    assert load_records("running.csv") == update_records(None, cold)
+
+
+def test_sync_skips_duplicates_and_stored_runs(sync_csv, capsys):
+    assert main.sync_data(
+        "2019-03-30 21:16:43,2019-04-05 07:00:00,2019-04-05 07:00:00",
+        "9.99,6.00,7.00",
+        "140,141,142",
+        "6:00,5:30,5:40",
+    )
+    assert sync_csv.read_text().splitlines() == [
+        *SYNC_LINES,
+        "2019-04-05 07:00:00,6.00,141,5:30",
+    ]
+    assert not main.sync_data("2019-04-05 07:00:00", "6.00", "141", "5:30")
+    assert "no new data" in capsys.readouterr().out
+
+
+def test_sync_dry_run_leaves_the_csv_untouched(sync_csv, capsys):
+    before = sync_csv.read_bytes()
+    assert main.sync_data(
+        "2019-03-29 06:00:00,2019-04-03 06:00:00",
+        "21.10,4.00",
+        "160,",
+        "5:10,6:00",
+        dry_run=True,
+    )
+    assert sync_csv.read_bytes() == before
+    out = capsys.readouterr().out
+    assert "would merge 2019-03-29 06:00:00,21.10,160,5:10" in out
+    # 也不写缓存
+    assert not os.path.exists(".running.csv.cache")
+
+
+def test_dry_run_fingerprint_does_not_write_the_cache(sync_csv):
+    fingerprint = main.get_render_fingerprint(write=False)
+    assert not os.path.exists(".running.csv.cache")
+    assert main.get_render_fingerprint() == fingerprint
+    assert os.path.exists(".running.csv.cache/meta.json")
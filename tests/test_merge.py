@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from merge import HEADER, merge_sources
+
+
+def write_source(path, lines: list[str]) -> str:
+    path.write_text("\n".join([HEADER, *lines]) + "\n")
+    return str(path)
+
+
+def read_output(path: str) -> list[str]:
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == HEADER
+    return lines[1:]
+
+
+@pytest.mark.parametrize(
+    "tolerance, expected",
+    [
+        (60, ["2019-03-29 21:49:00,3.25,148,6:31"]),
+        (
+            59,
+            [
+                "2019-03-29 21:49:00,3.25,148,6:31",
+                "2019-03-29 21:50:00,3.26,149,6:30",
+            ],
+        ),
+    ],
+)
+def test_tolerance_window(tmp_path, tolerance, expected):
+    first = write_source(tmp_path / "a.csv", ["2019-03-29 21:49:00,3.25,148,6:31"])
+    second = write_source(tmp_path / "b.csv", ["2019-03-29 21:50:00,3.26,149,6:30"])
+    output = str(tmp_path / "running.csv")
+    stats = merge_sources([first, second], output, tolerance)
+    assert read_output(output) == expected
+    assert stats == (2, len(expected), 2 - len(expected))
+
+
+def test_first_listed_source_wins(tmp_path):
+    garmin = write_source(tmp_path / "a.csv", ["2019-03-29 21:49:30,3.25,148,6:31"])
+    page = write_source(tmp_path / "b.csv", ["2019-03-29 21:49:01,3.20,,6:40"])
+    output = str(tmp_path / "running.csv")
+    merge_sources([garmin, page], output)
+    assert read_output(output) == ["2019-03-29 21:49:30,3.25,148,6:31"]
+    merge_sources([page, garmin], output)
+    assert read_output(output) == ["2019-03-29 21:49:01,3.20,,6:40"]
+
+
+def test_runs_of_the_same_source_are_kept(tmp_path):
+    # 同一个来源里相隔不到tolerance的是两次跑步，完全相同的开始时间才是重复
+    source = write_source(
+        tmp_path / "a.csv",
+        [
+            "2019-03-29 21:49:00,1.00,148,6:31",
+            "2019-03-29 21:49:00,1.00,148,6:31",
+            "2019-03-29 21:49:30,2.00,150,6:00",
+        ],
+    )
+    output = str(tmp_path / "running.csv")
+    assert merge_sources([source], output) == (3, 2, 1)
+    assert read_output(output) == [
+        "2019-03-29 21:49:00,1.00,148,6:31",
+        "2019-03-29 21:49:30,2.00,150,6:00",
+    ]
+
+
+def test_closed_runs_are_written_in_order(tmp_path):
+    # 第一个来源的记录开始得晚，保留它以后这次跑步排到了b.csv下一次跑步的后面
+    first = write_source(tmp_path / "a.csv", ["2019-03-29 21:49:50,5.00,150,6:00"])
+    second = write_source(
+        tmp_path / "b.csv",
+        ["2019-03-29 21:49:00,4.90,149,6:05", "2019-03-29 21:49:20,1.00,120,8:00"],
+    )
+    output = str(tmp_path / "running.csv")
+    assert merge_sources([first, second], output) == (3, 2, 1)
+    assert read_output(output) == [
+        "2019-03-29 21:49:20,1.00,120,8:00",
+        "2019-03-29 21:49:50,5.00,150,6:00",
+    ]
+
+
+def test_unsorted_source_aborts(tmp_path):
+    output = write_source(tmp_path / "running.csv", ["2019-03-01 07:00:00,1.00,,6:00"])
+    source = write_source(
+        tmp_path / "a.csv",
+        ["2019-03-29 21:49:00,3.25,148,6:31", "2019-03-28 21:49:00,3.25,148,6:31"],
+    )
+    with pytest.raises(ValueError, match="a.csv:3 is earlier than the line before"):
+        merge_sources([output, source], output)
+    assert read_output(output) == ["2019-03-01 07:00:00,1.00,,6:00"]
+    assert not (tmp_path / "running.csv.tmp").exists()
+
+
+def test_output_can_be_an_input(tmp_path):
+    output = write_source(
+        tmp_path / "running.csv",
+        ["2019-03-01 07:00:00,1.00,,6:00", "2019-03-29 21:49:00,3.25,148,6:31"],
+    )
+    other = write_source(
+        tmp_path / "a.csv",
+        ["2019-03-15 07:00:00,2.00,140,6:10", "2019-03-29 21:49:10,3.30,,6:30"],
+    )
+    assert merge_sources([output, other], output) == (4, 3, 1)
+    assert read_output(output) == [
+        "2019-03-01 07:00:00,1.00,,6:00",
+        "2019-03-15 07:00:00,2.00,140,6:10",
+        "2019-03-29 21:49:00,3.25,148,6:31",
+    ]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import date
+
+import pytest
+
+import main
+from records import get_current_streak, load_records
+from store import append_running_lines, get_cache_dir, merge_running_lines
+
+HEADER = "DT,distance(Km),heart,pace"
+# 周一到周三连着跑，隔一天，周五、周六，下周一
+RUNS = [
+    "2024-01-01 07:00:00,5.00,150,5:00",
+    "2024-01-02 07:00:00,10.50,150,5:30",
+    "2024-01-03 07:00:00,21.10,150,6:00",
+    "2024-01-05 07:00:00,5.00,150,4:50",
+    "2024-01-06 07:00:00,5.00,150,4:50",
+    "2024-01-08 07:00:00,3.00,150,4:00",
+]
+
+
+def write_log(tmp_path, lines: list[str]) -> str:
+    csv_path = tmp_path / "running.csv"
+    csv_path.write_text("\n".join([HEADER, *lines]) + "\n")
+    return str(csv_path)
+
+
+def rebuild(csv_path: str):
+    os.remove(os.path.join(get_cache_dir(csv_path), "records.json"))
+    return load_records(csv_path)
+
+
+def test_records(tmp_path):
+    records = load_records(write_log(tmp_path, RUNS))
+    assert (records.day.current, records.day.longest) == (1, 3)
+    assert (records.week.current, records.week.longest) == (2, 2)
+    assert records.bests == {
+        "5k": (290, "2024-01-05 07:00:00"),
+        "10k": (330, "2024-01-02 07:00:00"),
+        "half": (360, "2024-01-03 07:00:00"),
+    }
+
+
+def test_append_equals_rebuild(tmp_path):
+    csv_path = write_log(tmp_path, RUNS[:2])
+    load_records(csv_path)
+    for line in RUNS[2:]:
+        append_running_lines(csv_path, [line])
+        assert load_records(csv_path) == rebuild(csv_path)
+
+
+def test_out_of_order_insert_rebuilds(tmp_path):
+    csv_path = write_log(tmp_path, RUNS[1:])
+    load_records(csv_path)
+    merge_running_lines(csv_path, ["2024-01-01 07:00:00,5.00,150,4:00"])
+    records = load_records(csv_path)
+    assert records == rebuild(csv_path)
+    assert records.day.longest == 3
+    assert records.bests["5k"] == (240, "2024-01-01 07:00:00")
+
+
+@pytest.mark.parametrize(
+    "day, level, expected",
+    [
+        (date(2024, 1, 8), "day", 1),
+        (date(2024, 1, 9), "day", 1),
+        (date(2024, 1, 10), "day", 0),
+        (date(2024, 1, 14), "week", 2),
+        (date(2024, 1, 21), "week", 2),
+        (date(2024, 1, 22), "week", 0),
+    ],
+)
+def test_current_streak_ends_when_a_period_is_missed(tmp_path, day, level, expected):
+    records = load_records(write_log(tmp_path, RUNS))
+    assert get_current_streak(getattr(records, level), day, level) == expected
+
+
+def test_summary_plurals(tmp_path):
+    csv_path = write_log(tmp_path, RUNS)
+    text = main.get_summary(
+        "runner",
+        main.load_rollup(csv_path).year,
+        main.load_running_log(csv_path).dt[-1].item(),
+        3.0,
+        date(2024, 1, 9),
+        load_records(csv_path),
+    )
+    assert "streak 1 day 2 weeks" in text
+    assert "longest 3 days 2 weeks" in text
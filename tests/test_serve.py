@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from datetime import date, timedelta
+
+import serve
+
+
+def test_state_changes_with_the_log_and_the_date(tmp_path):
+    path = tmp_path / "running.csv"
+    day = date(2026, 12, 31)
+    assert serve.get_state(str(path), day) is None
+    path.write_text("DT,distance(Km),heart,pace\n")
+    state = serve.get_state(str(path), day)
+    assert serve.get_state(str(path), day) == state
+    # 跨年
+    assert serve.get_state(str(path), day + timedelta(days=1)) != state
+    with open(path, "a") as f:
+        f.write("2026-12-31 07:00:00,5.00,150,6:00\n")
+    assert serve.get_state(str(path), day) != state
+    # 大小不变但是改过
+    path.write_text("DT,distance(Km),heart,pace\n")
+    os.utime(path, ns=(0, 0))
+    assert serve.get_state(str(path), day) != state
+
+
+def test_watch_updates_when_the_date_changes(tmp_path, monkeypatch, capsys):
+    class Today(date):
+        days = 0
+
+        @classmethod
+        def today(cls):
+            return date(2026, 12, 31) + timedelta(days=cls.days)
+
+    monkeypatch.setattr(serve, "date", Today)
+    path = tmp_path / "running.csv"
+    path.write_text("DT,distance(Km),heart,pace\n")
+    stop = threading.Event()
+    calls = []
+
+    def on_change():
+        calls.append(Today.today())
+        if len(calls) == 1:
+            Today.days = 1
+        elif len(calls) == 2:
+            raise RuntimeError("retried at the next change")
+        else:
+            stop.set()
+
+    ticks = []
+
+    def tick(interval):
+        ticks.append(len(calls))
+        if len(ticks) == 3:
+            Today.days = 2
+        return stop.is_set()
+
+    monkeypatch.setattr(stop, "wait", tick)
+    serve.watch(str(path), 0, on_change, stop)
+    assert calls == [date(2026, 12, 31), date(2027, 1, 1), date(2027, 1, 2)]
+    # 出错以后不重试，文件和日期都没变的那次也不调用on_change
+    assert ticks == [1, 2, 2, 3]
+    assert "retried at the next change" in capsys.readouterr().err
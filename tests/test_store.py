@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+
+import pytest
+
+from main import get_running_data
+from store import append_running_lines, load_running_log
+
+HEADER = "DT,distance(Km),heart,pace"
+
+
+def get_running_data_by_row(csv_path: str):
+    """
+    The row by row parser get_running_data used before the columnar cache
+    """
+    data = []
+    with open(csv_path) as file:
+        for line in file:
+            cols = line.rstrip().split(",")
+            if cols[0] == "DT":
+                continue
+            dt = datetime.strptime(cols[0], "%Y-%m-%d %H:%M:%S")
+            distance = float(cols[1])
+            heart = int(cols[2]) if cols[2].isdecimal() else None
+            mins, secs = [int(i) for i in cols[3].split(":")]
+            if secs == 60:
+                mins = mins + 1
+                secs = 0
+            if distance <= 0.0:
+                continue
+            data.append((dt, distance, heart, mins * 60 + secs))
+    data.sort(key=lambda t: t[0])
+    acc = 0.0
+    dts, accs, distances, hearts, paces = [], [], [], [], []
+    for dt, distance, heart, pace in data:
+        acc += distance
+        dts.append(dt)
+        accs.append(acc)
+        distances.append(distance)
+        if heart:
+            hearts.append(heart)
+        paces.append(pace)
+    return dts, accs, distances, hearts, paces
+
+
+def write_csv(path, lines: list[str], newline: str = "\n") -> str:
+    path.write_bytes(newline.join(lines).encode() + newline.encode())
+    return str(path)
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [
+        pytest.param(
+            [
+                HEADER,
+                "2019-03-29 21:49:01,3.25,148,6:31",
+                "2019-03-30 21:16:43,3.23,,6:22",
+                "2019-03-31 07:00:00,5.00,0,5:60",
+            ],
+            id="blank-heart-and-5:60",
+        ),
+        pytest.param(
+            [
+                HEADER,
+                "2019-03-29 21:49:01,10.005,148,6:31",
+                "2019-03-30 21:16:43,3.1234,150,6:22",
+                "2019-03-31 07:00:00,0.1,151,6:00",
+                "2019-04-01 07:00:00,42.195,152,5:00",
+            ],
+            id="more-than-two-decimals",
+        ),
+        pytest.param(
+            [
+                "2019-04-01 07:00:00,5.5,300,5:00",
+                "2019-03-29 21:49:01,3.25,148,6:31",
+                HEADER,
+                "2019-03-30 21:16:43,0.00,150,6:22",
+                "2019-03-30 06:00:00,8,150,12:05",
+            ],
+            id="unsorted-headers-zero-distance-high-heart",
+        ),
+        pytest.param(
+            [
+                HEADER,
+                "2019-3-29 21:49:01,3.25,148,6:31",
+                "2019-03-30 7:16:43,3.23,150,6:22",
+                "2019-03-31 07:00:00,1e1,150,6:22",
+            ],
+            id="non-canonical",
+        ),
+        pytest.param(
+            [
+                HEADER,
+                f"2019-03-29 21:49:01,{'0' * 2000}3.25,{'0' * 20}148,6:31",
+                f"2019-03-30 21:16:43,3.23,150,{'0' * 30}5:{'0' * 30}60",
+            ],
+            id="long-fields",
+        ),
+    ],
+)
+@pytest.mark.parametrize("newline", ["\n", "\r\n"], ids=["lf", "crlf"])
+def test_parity_with_row_parser(tmp_path, lines, newline):
+    csv_path = write_csv(tmp_path / "running.csv", lines, newline)
+    expected = get_running_data_by_row(csv_path)
+    assert get_running_data(csv_path) == expected
+    # 第二次读的是缓存
+    assert get_running_data(csv_path) == expected
+
+
+def test_parity_after_append(tmp_path):
+    lines = [HEADER, "2019-03-29 21:49:01,3.25,148,6:31"]
+    csv_path = write_csv(tmp_path / "running.csv", lines)
+    get_running_data(csv_path)
+    append_running_lines(csv_path, ["2019-03-30 21:16:43,10.005,,5:60"])
+    assert get_running_data(csv_path) == get_running_data_by_row(csv_path)
+
+
+@pytest.mark.parametrize(
+    "line", ["2019-03-29 21:49:01,3.25,70000,6:31", "2019-03-29 21:49:01,3.25,1,-1:30"]
+)
+def test_out_of_range_is_rejected(tmp_path, line):
+    csv_path = write_csv(tmp_path / "running.csv", [HEADER, line])
+    with pytest.raises(ValueError, match="out of range"):
+        load_running_log(csv_path)
+
+
+def test_rewritten_file_is_reparsed(tmp_path):
+    # 改了前面一行（长度不变）又在最后加了一行，尾部哈希对得上也不能当成追加
+    # 比尾部哈希的4KB长，改的那行不在哈希的范围里
+    lines = [HEADER] + [
+        f"{2000 + year}-03-{day:02d} 21:49:01,3.25,148,6:31"
+        for year in range(10)
+        for day in range(1, 29)
+    ]
+    csv_path = write_csv(tmp_path / "running.csv", lines)
+    load_running_log(csv_path)
+    lines[1] = lines[1].replace(",148,", ",150,")
+    tmp = tmp_path / "running.csv.tmp"
+    write_csv(tmp, lines + ["2010-03-01 21:49:01,3.25,148,6:31"])
+    os.replace(tmp, csv_path)
+    assert get_running_data(csv_path) == get_running_data_by_row(csv_path)
+    assert load_running_log(csv_path).heart[0] == 150
+
+
+def test_read_only_load_does_not_write_the_cache(tmp_path):
+    lines = [HEADER, "2019-03-29 21:49:01,3.25,148,6:31"]
+    csv_path = write_csv(tmp_path / "running.csv", lines)
+    cache_dir = tmp_path / ".running.csv.cache"
+    assert load_running_log(csv_path, write=False).heart.tolist() == [148]
+    assert not cache_dir.exists()
+    load_running_log(csv_path)
+    meta = (cache_dir / "meta.json").read_bytes()
+    with open(csv_path, "a") as f:
+        f.write("2019-03-30 21:16:43,3.23,,6:22\n")
+    log = load_running_log(csv_path, write=False)
+    assert log.heart_mask.tolist() == [True, False]
+    assert (cache_dir / "meta.json").read_bytes() == meta